@@ -1,3 +1,6 @@
 #!/bin/bash
+if [ "$1" = "worker" ]; then
+  cd /app && exec proxychains4 python -m app.worker
+fi
 cd lib/python3.13/site-packages/app/db && alembic -c alembic.prod.ini upgrade head && cd /app
-proxychains4 gunicorn app.main:fastapi_app -w 1 -k uvicorn.workers.UvicornWorker -b 0.0.0.0:80 --forwarded-allow-ips="*"
+proxychains4 gunicorn app.main:fastapi_app -w "${GUNICORN_WORKERS:-1}" -k uvicorn.workers.UvicornWorker -b 0.0.0.0:80 --forwarded-allow-ips="*"
@@ -4,7 +4,7 @@ from starlette.datastructures import FormData, UploadFile
 from starlette.requests import Request
 import io
 
-from .views import PromptCategoryView, TaskView, PromptView, TaskImageView, TaskItemView, PromptUserInputView
+from .views import PromptCategoryView, TaskView, PromptView, TaskImageView, TaskItemView, PromptUserInputView, WebhookDeliveryView
 from .auth import authentication_backend
 from app.db.tables import engine
 
@@ -29,7 +29,7 @@ class FixedAdmin(Admin):
             await value.seek(0)
             if should_clear:
                 form_data.append((key, UploadFile(io.BytesIO(b""))))
-            elif empty_upload and obj and getattr(obj, key):
+            elif empty_upload and obj and getattr(obj, key, None):
                 f = getattr(obj, key)  # In case of update, imitate UploadFile
                 form_data.append((key, f))
             else:
@@ -46,4 +46,5 @@ def attach_admin_panel(application: FastAPI):
     admin.add_view(TaskItemView)
     admin.add_view(PromptUserInputView)
     admin.add_view(PromptCategoryView)
+    admin.add_view(WebhookDeliveryView)
 
@@ -1,17 +1,25 @@
-import io
-from fastapi import Request
-from starlette.datastructures import FormData, UploadFile
-from app.db.tables import PromptCategory, Task, Prompt, TaskItem, TaskImage, PromptUserInput
+from app.db.tables import PromptCategory, Task, Prompt, TaskItem, TaskImage, PromptUserInput, WebhookDelivery
+from app.repositories.cache import prompt_cache
+from app.repositories.prompt import PromptRepository
 from sqladmin import ModelView
 from sqladmin.formatters import Markup
 from wtforms import FileField
-import base64
+
+
+class PromptCacheMixin:
+    """Invalidate cached prompts and categories after admin changes"""
+
+    async def after_model_change(self, data, model, is_created, request):
+        await prompt_cache.invalidate()
+
+    async def after_model_delete(self, model, request):
+        await prompt_cache.invalidate()
 
 
 def format_image_url(model, attribute) -> Markup:
-    if attribute not in model.__dict__ or getattr(model, attribute) is None:
-        return Markup('<div></div>')
-    return Markup(f'<img src="data:image/png;base64, {base64.b64encode(getattr(model, attribute)).decode()}" />')
+    return Markup(
+        f'<img src="{getattr(model, attribute)}?size=128" loading="lazy" onerror="this.remove()" />'
+    )
 
 
 class TaskView(ModelView, model=Task):
@@ -31,53 +39,44 @@ class TaskItemView(ModelView, model=TaskItem):
     column_searchable_list = [TaskItem.id]
 
 
-class PromptView(ModelView, model=Prompt):
-    column_list = [Prompt.title, Prompt.image, Prompt.text]
+class PromptView(PromptCacheMixin, ModelView, model=Prompt):
+    column_list = [Prompt.title, "image_url", Prompt.text]
+    column_labels = {"image_url": "Image"}
     column_searchable_list = [Prompt.id, Prompt.title]
     column_default_sort = [(Prompt.created_at, True)]
-    column_formatters = {"image": format_image_url}
-    column_formatters_detail = {"image": format_image_url}
-    form_overrides = dict(image=FileField)
-
-    async def _handle_form_data(self, request: Request, obj = None) -> FormData:
-        """
-        Handle form data and modify in case of UploadFile.
-        This is needed since in edit page
-        there's no way to show current file of object.
-        """
-
-        form = await request.form()
-        form_data: list[tuple[str, str | UploadFile]] = []
-        for key, value in form.multi_items():
-            if not isinstance(value, UploadFile):
-                form_data.append((key, value))
-                continue
-
-            should_clear = form.get(key + "_checkbox")
-            empty_upload = len(await value.read(1)) != 1
-            await value.seek(0)
-            if should_clear:
-                form_data.append((key, UploadFile(io.BytesIO(b""))))
-            elif empty_upload and obj and getattr(obj, key):
-                f = getattr(obj, key)  # In case of update, imitate UploadFile
-                form_data.append((key, UploadFile(filename="tmp.png", file=f.open())))
-            else:
-                form_data.append((key, value))
-        return FormData(form_data)
+    column_formatters = {"image_url": format_image_url}
+
+    async def scaffold_form(self, rules=None):
+        form = await super().scaffold_form(rules)
+        form.image = FileField("Image")
+        return form
 
     async def on_model_change(self, data: dict, model, is_created, request):
-        if is_created:
-            data['image'] = await data['image'].read()
-            if not data['image']:
-                data['image'] = None
+        """Image is not a column, it is stored in prompt_images after the prompt is saved"""
+        image = data.pop("image", None)
+        request.state.prompt_image = await image.read() if image is not None else b""
+        request.state.prompt_image_clear = bool((await request.form()).get("image_checkbox"))
         return data
 
+    async def after_model_change(self, data, model, is_created, request):
+        image = getattr(request.state, "prompt_image", b"")
+        if image or request.state.prompt_image_clear:
+            async with PromptRepository() as repository:
+                await repository.set_image(model.id, image or None)
+        await super().after_model_change(data, model, is_created, request)
 
-class PromptCategoryView(ModelView, model=PromptCategory):
+
+class PromptCategoryView(PromptCacheMixin, ModelView, model=PromptCategory):
     column_list = "__all__"
     column_searchable_list = [PromptCategory.id, PromptCategory.name]
 
 
-class PromptUserInputView(ModelView, model=PromptUserInput):
+class PromptUserInputView(PromptCacheMixin, ModelView, model=PromptUserInput):
     column_list = "__all__"
     column_searchable_list = [PromptUserInput.id]
+
+
+class WebhookDeliveryView(ModelView, model=WebhookDelivery):
+    column_list = "__all__"
+    column_searchable_list = [WebhookDelivery.id, WebhookDelivery.task_id]
+    column_default_sort = [(WebhookDelivery.created_at, True)]
@@ -1,12 +1,14 @@
 import datetime as dt
+import os
 import uuid
 from uuid import UUID
 from enum import Enum, auto
 
-from sqlalchemy import TEXT, LargeBinary, bindparam
+from sqlalchemy import TEXT, DateTime, LargeBinary, bindparam, literal_column
 from sqlalchemy import CheckConstraint
 from sqlalchemy import Column
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import Table
 from sqlalchemy import text
 from sqlalchemy import UniqueConstraint
@@ -23,9 +25,17 @@ from sqlalchemy.ext.associationproxy import AssociationProxy
 from sqlalchemy_service import Base
 from sqlalchemy_service.base_db.base import ServiceEngine
 
-sql_utcnow = text("(now() at time zone 'utc')")
+# Typed, so it can be used in date arithmetic in queries too
+sql_utcnow = literal_column("(now() at time zone 'utc')", DateTime)
 
-engine = ServiceEngine()
+# Every in-flight OpenAI request may hold two sessions (task and context or webhook),
+# the rest is for the LISTEN connection, dispatch sweeps and API handlers
+db_pool_size = int(os.getenv("DB_POOL_SIZE", "40"))
+db_max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+db_reserved_connections = int(os.getenv("DB_RESERVED_CONNECTIONS", "8"))
+sessions_per_request = 2
+
+engine = ServiceEngine(pool_size=db_pool_size, max_overflow=db_max_overflow)
 
 
 class BaseMixin:
@@ -49,7 +59,7 @@ class TaskItem(Base):
     __tablename__ = "task_items"
 
     id: M[int] = column(primary_key=True, index=True, autoincrement=True)
-    task_id: M[UUID] = column(ForeignKey('tasks.id', ondelete="CASCADE"))
+    task_id: M[UUID] = column(ForeignKey('tasks.id', ondelete="CASCADE"), index=True)
     result_url: M[str | None]
 
     task: M['Task'] = relationship(back_populates='items')
@@ -86,7 +96,6 @@ class Prompt(BaseMixin, Base):
     is_model: M[bool]
     for_image: M[bool]
     for_video: M[bool]
-    image: M[bytes | None] = column(type_=LargeBinary, nullable=True)
     category_name: M[str | None] = column(ForeignKey("prompt_categories.id", ondelete="CASCADE"))
 
     user_inputs: M[list['PromptUserInput']] = relationship(back_populates="prompt", lazy="selectin")
@@ -95,6 +104,19 @@ class Prompt(BaseMixin, Base):
     def __str__(self) -> str:
         return f"Prompt {self.title}"
 
+    @property
+    def image_url(self) -> str:
+        return f"/api/model/{self.id}/image"
+
+
+class PromptImage(Base):
+    """Prompt preview image, kept apart so prompt queries don't load it"""
+    __tablename__ = "prompt_images"
+
+    prompt_id: M[UUID] = column(ForeignKey("prompts.id", ondelete="CASCADE"), primary_key=True)
+    body: M[bytes] = column(type_=LargeBinary)
+    etag: M[str]
+
 
 class TaskImage(BaseMixin, Base):
     external_id: M[str]
@@ -103,15 +125,38 @@ class TaskImage(BaseMixin, Base):
     task: M['Task'] = relationship(back_populates='images')
 
 
+class TaskRequestLane(Enum):
+    text2text = 'text2text'
+    text2image = 'text2image'
+    image2image = 'image2image'
+
+
 class TaskRequest(BaseMixin, Base):
     id: M[int] = column(primary_key=True, index=True, autoincrement=True)
-    task_id: M[UUID] = column(ForeignKey('tasks.id', ondelete="CASCADE"))
+    task_id: M[UUID] = column(ForeignKey('tasks.id', ondelete="CASCADE"), index=True)
     schema: M[str]
     status: M[str | None]
+    lane: M[str] = column(server_default=TaskRequestLane.text2image.value, index=True)
+    lease_owner: M[str | None]
+    lease_expires_at: M[dt.datetime | None]
+
+
+class WebhookDelivery(BaseMixin, Base):
+    __tablename__ = "webhook_deliveries"
+
+    id: M[int] = column(primary_key=True, index=True, autoincrement=True)
+    task_id: M[UUID] = column(ForeignKey('tasks.id', ondelete="CASCADE"))
+    url: M[str]
+    status: M[str | None]
+    attempts: M[int] = column(server_default="0", default=0)
+    next_attempt_at: M[dt.datetime] = column(server_default=sql_utcnow, index=True)
+    last_error: M[str | None]
 
 
 class Context(BaseMixin, Base):
     user_id: M[str]
+    text_length: M[int] = column(server_default="0", default=0)
+    images_count: M[int] = column(server_default="0", default=0)
 
     entities: M[list["ContextEntity"]] = relationship(back_populates="context", lazy="selectin", cascade="all,delete")
     tasks: M[list["Task"]] = relationship(back_populates="context", lazy="selectin", cascade="all,delete")
@@ -136,6 +181,10 @@ class ContextEntity(BaseMixin, Base):
 
     context: M['Context'] = relationship(back_populates="entities", lazy="noload")
 
+    __table_args__ = (
+        Index("ix_context_entitys_image_content", "content", postgresql_where=text("content_type = 'image'")),
+    )
+
 
 class PromptCategory(BaseMixin, Base):
     __tablename__ = "prompt_categories"
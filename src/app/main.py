@@ -7,14 +7,23 @@ from fastapi.staticfiles import StaticFiles
 from pydantic_settings import BaseSettings
 from loguru import logger
 from contextlib import asynccontextmanager
-from fastapi_utils.tasks import repeat_every
+import asyncio
 
 from app.db.admin import attach_admin_panel
-from app.services.task import TaskService
+from app.repositories.cache import prompt_cache
+from app.repositories.notification import notification_listener
+from app.repositories.openai import OpenAIRepository
+from app.repositories.storage import get_storage_repository
+from app.services.dispatcher import dispatcher, storage_gc_dispatcher, webhook_dispatcher
+from app.services.image_processor import image_processor
+from app.services.result_variants import result_variants
+from app.services.task_events import task_events
+from app.services.webhook import WebhookService
 
 
 class ProjectSettings(BaseSettings):
     LOCAL_MODE: bool = False
+    DISPATCHER_ENABLED: bool = True
 
 
 def register_exception(application):
@@ -39,16 +48,28 @@ def register_cors(application):
     )
 
 
-@repeat_every(seconds=15, wait_first=15, raise_exceptions=True)
-async def process_requests():
-    async with TaskService() as task_service:
-        await task_service.process_requests()
-
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await process_requests()
+    storage_migration = None
+    if ProjectSettings().DISPATCHER_ENABLED:
+        dispatcher.start()
+        webhook_dispatcher.start()
+        storage_gc_dispatcher.start()
+        storage_migration = asyncio.create_task(get_storage_repository().migrate_legacy())
+    task_events.start()
+    prompt_cache.start()
     yield
+    if storage_migration is not None:
+        storage_migration.cancel()
+    await notification_listener.stop()
+    await dispatcher.stop()
+    await webhook_dispatcher.stop()
+    await storage_gc_dispatcher.stop()
+    await result_variants.stop()
+    image_processor.shutdown()
+    await OpenAIRepository.close()
+    await WebhookService.close()
+    await get_storage_repository().close()
 
 
 def init_web_application():
@@ -0,0 +1,190 @@
+from collections import OrderedDict
+from contextlib import suppress
+from pathlib import Path
+from typing import Any, Hashable
+from sqlalchemy import func, select
+import asyncio
+import os
+import time
+import uuid
+
+from app.db.tables import engine
+from app.repositories.notification import notification_listener
+
+
+class LRUCache[Value: (bytes, str)]:
+    """In-memory LRU cache limited by total size of values"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self._items: OrderedDict[str, Value] = OrderedDict()
+
+    def get(self, key: str) -> Value | None:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Value):
+        if len(value) > self.max_size:
+            return
+        self.delete(key)
+        self._items[key] = value
+        self.size += len(value)
+        while self.size > self.max_size:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= len(evicted)
+
+    def delete(self, key: str):
+        value = self._items.pop(key, None)
+        if value is not None:
+            self.size -= len(value)
+
+
+class ConvertedImageCache:
+    """
+    RGB PNG versions of stored images, keyed by storage filename.
+    Stored files never change, so entries are never stale.
+    Memory tier is an LRU, disk tier is enabled by CONVERTED_IMAGES_DIRECTORY.
+    Disk tier is pruned to CONVERTED_IMAGES_DIRECTORY_SIZE bytes, least recently used first,
+    so copies of deleted images are dropped eventually.
+    """
+    max_size = int(os.getenv("CONVERTED_IMAGES_CACHE_SIZE", str(256 * 1024 * 1024)))
+    directory = os.getenv("CONVERTED_IMAGES_DIRECTORY")
+    max_disk_size = int(os.getenv("CONVERTED_IMAGES_DIRECTORY_SIZE", str(2 * 1024 * 1024 * 1024)))
+    prune_ratio = 0.9  # Prune below the limit, so it is not scanned on every write
+    temporary_file_lifetime = 60 * 60
+
+    def __init__(self):
+        self.memory = LRUCache[bytes](self.max_size)
+        self.base_directory = Path(self.directory) if self.directory else None
+        self.disk_size: int | None = None  # Estimate, other processes write too
+        if self.base_directory is not None:
+            self.base_directory.mkdir(parents=True, exist_ok=True)
+
+    def _read(self, filename: str) -> bytes | None:
+        path = self.base_directory / filename
+        try:
+            body = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        with suppress(FileNotFoundError):
+            os.utime(path)  # Modification time is the last use for pruning
+        return body
+
+    def _write(self, filename: str, body: bytes):
+        # Unique per write, as processes may convert the same image at once
+        temporary_path = self.base_directory / f"{filename}.{uuid.uuid4().hex}.tmp"
+        try:
+            temporary_path.write_bytes(body)
+            temporary_path.replace(self.base_directory / filename)
+        except BaseException:
+            temporary_path.unlink(missing_ok=True)
+            raise
+
+    def _prune(self, max_size: int) -> int:
+        """
+        Delete least recently used files until the directory is under max_size. Return its size.
+        Temporary files are left to their writers, unless they are stale leftovers of a crash.
+        """
+        now = time.time()
+        files = []
+        with os.scandir(self.base_directory) as entries:
+            for entry in entries:
+                try:
+                    stat_result = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(".tmp") and now - stat_result.st_mtime < self.temporary_file_lifetime:
+                    continue
+                files.append((stat_result.st_mtime, stat_result.st_size, entry.path))
+
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in sorted(files):
+            if size <= max_size:
+                break
+            with suppress(FileNotFoundError):
+                os.unlink(path)
+            size -= file_size
+        return size
+
+    async def get(self, filename: str) -> bytes | None:
+        body = self.memory.get(filename)
+        if body is None and self.base_directory is not None:
+            body = await asyncio.to_thread(self._read, filename)
+            if body is not None:
+                self.memory.set(filename, body)
+        return body
+
+    async def set(self, filename: str, body: bytes):
+        self.memory.set(filename, body)
+        if self.base_directory is None:
+            return
+        await asyncio.to_thread(self._write, filename, body)
+        if self.disk_size is not None:
+            self.disk_size += len(body)
+        if self.disk_size is None or self.disk_size > self.max_disk_size:
+            self.disk_size = await asyncio.to_thread(self._prune, int(self.max_disk_size * self.prune_ratio))
+
+    async def delete(self, filename: str):
+        self.memory.delete(filename)
+        if self.base_directory is not None:
+            await asyncio.to_thread((self.base_directory / filename).unlink, True)
+
+
+class TTLCache:
+    """
+    In-memory cache with entries expiring after ttl seconds, at most max_entries of them.
+    When it is full, expired entries are dropped, then the oldest ones.
+    invalidate() clears it in this process and, by Postgres NOTIFY on the channel,
+    in the other processes which called start().
+    """
+
+    def __init__(self, ttl: float, channel: str, max_entries: int = 1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.channel = channel
+        self._items: dict[Hashable, tuple[float, Any]] = {}
+
+    def get(self, key: Hashable) -> Any | None:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self._items.pop(key, None)
+            return None
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        now = time.monotonic()
+        self._items.pop(key, None)
+        if len(self._items) >= self.max_entries:
+            self._items = {
+                item_key: item for item_key, item in self._items.items() if item[0] >= now
+            }
+        while len(self._items) >= self.max_entries:
+            self._items.pop(next(iter(self._items)))
+        self._items[key] = (now + self.ttl, value)
+
+    def clear(self, *_):
+        self._items.clear()
+
+    async def invalidate(self):
+        self.clear()
+        async with engine.engine.connect() as connection:
+            await connection.execute(select(func.pg_notify(self.channel, "")))
+            await connection.commit()
+
+    def start(self):
+        notification_listener.subscribe(self.channel, self.clear)
+
+
+converted_image_cache = ConvertedImageCache()
+data_url_cache = LRUCache[str](int(os.getenv("DATA_URLS_CACHE_SIZE", str(128 * 1024 * 1024))))
+prompt_cache = TTLCache(
+    float(os.getenv("PROMPTS_CACHE_TTL", "300")),
+    channel="prompts_changed",
+    max_entries=int(os.getenv("PROMPTS_CACHE_MAX_ENTRIES", "1000")),
+)
@@ -1,7 +1,7 @@
 from contextlib import suppress
 from fastapi import Response, HTTPException
 from loguru import logger
-from sqlalchemy import exc, select
+from sqlalchemy import exc, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy_service import BaseService as BaseRepository
 from uuid import UUID
@@ -57,6 +57,32 @@ class ContextRepository[Table: Context, int](BaseRepository):
             raise HTTPException(404)
         return model
 
+    async def increase_usage(
+        self, model_id: UUID, text_length: int = 0, images_count: int = 0
+    ) -> tuple[int, int]:
+        """
+        Increase context usage counters without commit.
+        Row stays locked until commit, so concurrent inserts are serialized.
+        Return new (text_length, images_count).
+        """
+        query = (
+            update(Context)
+            .where(Context.id == model_id)
+            .values(
+                text_length=Context.text_length + text_length,
+                images_count=Context.images_count + images_count,
+            )
+            .returning(Context.text_length, Context.images_count)
+            .execution_options(synchronize_session=False)
+        )
+        row = (await self.session.execute(query)).first()
+        if row is None:
+            raise HTTPException(404, detail="Context not found")
+        return tuple(row)
+
+    async def rollback(self):
+        await self.session.rollback()
+
     async def update(self, model_id: UUID, **fields) -> Context:
         return await self._update(model_id, **fields)
 
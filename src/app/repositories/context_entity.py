@@ -1,12 +1,12 @@
 from contextlib import suppress
 from fastapi import Response, HTTPException
 from loguru import logger
-from sqlalchemy import exc
+from sqlalchemy import case, exc, func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy_service import BaseService as BaseRepository
 from uuid import UUID
 
-from app.db.tables import ContextEntity, engine
+from app.db.tables import ContextEntity, ContextEntityContentType, engine
 
 
 class ContextEntityRepository[Table: ContextEntity, int](BaseRepository):
@@ -44,6 +44,42 @@ class ContextEntityRepository[Table: ContextEntity, int](BaseRepository):
     async def list(self, context_id: str | UUID | None = None, page=None, count=None) -> list[ContextEntity]:
         return list(await self._get_list(context_id=context_id, page=page, count=count))
 
+    async def list_content(
+        self,
+        context_id: UUID,
+        last_count: int | None = None,
+        max_text_length: int | None = None,
+    ):
+        """
+        Select only role, content and content_type of context entities, ordered by creation.
+        Optionally keep only the last_count entities
+        and the latest entities whose text fits in max_text_length.
+        """
+        text_length = case(
+            (ContextEntity.content_type == ContextEntityContentType.text, func.length(ContextEntity.content)),
+            else_=0,
+        )
+        query = (
+            select(
+                ContextEntity.role,
+                ContextEntity.content,
+                ContextEntity.content_type,
+                ContextEntity.created_at,
+                func.sum(text_length).over(order_by=ContextEntity.created_at.desc()).label("tail_length"),
+            )
+            .filter_by(context_id=context_id)
+            .order_by(ContextEntity.created_at.desc())
+        )
+        if last_count is not None:
+            query = query.limit(last_count)
+        subquery = query.subquery()
+
+        query = select(subquery.c.role, subquery.c.content, subquery.c.content_type)
+        if max_text_length is not None:
+            query = query.filter(subquery.c.tail_length <= max_text_length)
+        query = query.order_by(subquery.c.created_at.asc())
+        return list(await self.session.execute(query))
+
     async def get(self, model_id: UUID) -> ContextEntity:
         return await self._get_one(
             id=model_id,
@@ -58,3 +94,15 @@ class ContextEntityRepository[Table: ContextEntity, int](BaseRepository):
     async def count(self):
         return await self._count()
 
+    async def list_image_references(self, filenames: "list[str]") -> set[str]:
+        """Filenames used as images in contexts"""
+        query = (
+            select(ContextEntity.content)
+            .filter(
+                ContextEntity.content_type == ContextEntityContentType.image,
+                ContextEntity.content.in_(filenames),
+            )
+            .distinct()
+        )
+        return set(await self.session.scalars(query))
+
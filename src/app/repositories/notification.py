@@ -0,0 +1,68 @@
+import asyncio
+import os
+from typing import Callable
+from loguru import logger
+
+from app.db.tables import engine
+
+
+class NotificationListener:
+    """
+    Postgres LISTEN for all subscribed channels over one connection.
+    Callbacks get the notification payload.
+    Reconnects after retry_interval if the connection is lost.
+    """
+    retry_interval = float(os.getenv("NOTIFICATIONS_RETRY_INTERVAL", "5"))
+
+    def __init__(self):
+        self.callbacks: dict[str, list[Callable[[str], None]]] = {}
+        self._connection = None
+        self._task: asyncio.Task | None = None
+
+    def _on_notification(self, connection, pid, channel, payload):
+        for callback in self.callbacks.get(channel, []):
+            callback(payload)
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]):
+        if callback in self.callbacks.get(channel, []):
+            return
+        self.callbacks.setdefault(channel, []).append(callback)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        elif self._connection is not None and len(self.callbacks[channel]) == 1:
+            asyncio.create_task(self._connection.add_listener(channel, self._on_notification))
+
+    async def _run(self):
+        while True:
+            try:
+                async with engine.engine.connect() as connection:
+                    raw_connection = await connection.get_raw_connection()
+                    self._connection = raw_connection.driver_connection
+                    try:
+                        for channel in list(self.callbacks):
+                            await self._connection.add_listener(channel, self._on_notification)
+                        while not self._connection.is_closed():
+                            await asyncio.sleep(self.retry_interval)
+                    finally:
+                        if not self._connection.is_closed():
+                            for channel in list(self.callbacks):
+                                await self._connection.remove_listener(channel, self._on_notification)
+                        self._connection = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Error on listen notifications: {e}")
+            await asyncio.sleep(self.retry_interval)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+notification_listener = NotificationListener()
@@ -5,16 +5,110 @@ from app.schemas.external import (
     ExternalText2ImageTaskSchema,
     ExternalText2TextTaskSchema,
 )
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from loguru import logger
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable
+import httpx
 import io
 import base64
 import json
+import os
+import re
+
+ImageWriter = Callable[[AsyncIterable[bytes]], Awaitable[int]]
+
+
+class Base64ImageDecoder:
+    """
+    Incremental decoder of the first "b64_json" value in a JSON response body.
+    feed() returns decoded image bytes, the rest of the body is kept in rest
+    with the value emptied, so the base64 string is never held whole.
+    """
+    marker = re.compile(rb'"b64_json"\s*:\s*"')
+    marker_max_length = 64
+
+    def __init__(self):
+        self.rest = bytearray()
+        self._pending = b""  # Possible beginning of the marker
+        self._carry = b""  # Base64 characters not forming a full group yet
+        self._state = "scan"
+
+    def _decode(self, value: bytes, final: bool = False) -> bytes:
+        value = self._carry + value.replace(b"\\", b"")
+        end = len(value) if final else len(value) - len(value) % 4
+        self._carry = value[end:]
+        return base64.b64decode(value[:end])
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self._state == "done":
+            self.rest += chunk
+            return b""
+
+        if self._state == "scan":
+            chunk = self._pending + chunk
+            match = self.marker.search(chunk)
+            if match is None:
+                keep = min(len(chunk), self.marker_max_length)
+                self.rest += chunk[:len(chunk) - keep]
+                self._pending = chunk[len(chunk) - keep:]
+                return b""
+            self.rest += chunk[:match.end()]
+            self._pending = b""
+            self._state = "value"
+            chunk = chunk[match.end():]
+
+        end = chunk.find(b'"')
+        if end == -1:
+            return self._decode(chunk)
+        self._state = "done"
+        self.rest += chunk[end:]
+        return self._decode(chunk[:end], final=True)
+
+    def close(self) -> dict:
+        """Parse the rest of the response"""
+        self.rest += self._pending
+        return json.loads(self.rest) if self.rest else {}
 
 
 class OpenAIRepository:
+    """
+    OpenAI API calls. All instances share one process-wide client,
+    so connections stay warm between requests.
+    HTTP/2 (OPENAI_HTTP2) requires the h2 package.
+    """
+    max_connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", "32"))
+    max_keepalive_connections = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "16"))
+    keepalive_expiry = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "120"))
+    http2 = os.getenv("OPENAI_HTTP2", "false").lower() == "true"
+    timeout = float(os.getenv("OPENAI_TIMEOUT", "600"))
+    connect_timeout = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10"))
+
+    _client: AsyncOpenAI | None = None
+
     def __init__(self):
-        self.client = AsyncOpenAI()
+        self.client = self.get_client()
+
+    @classmethod
+    def get_client(cls) -> AsyncOpenAI:
+        if cls._client is None:
+            cls._client = AsyncOpenAI(
+                timeout=httpx.Timeout(cls.timeout, connect=cls.connect_timeout),
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=cls.max_connections,
+                        max_keepalive_connections=cls.max_keepalive_connections,
+                        keepalive_expiry=cls.keepalive_expiry,
+                    ),
+                    http2=cls.http2,
+                ),
+            )
+        return cls._client
+
+    @classmethod
+    async def close(cls):
+        if cls._client is not None:
+            await cls._client.close()
+            cls._client = None
 
     async def generate_text2text(
         self, request: ExternalText2TextTaskSchema
@@ -30,45 +124,63 @@ class OpenAIRepository:
             reset_in=raw_response.headers.get("x-ratelimit-reset-requests"),
         )
 
+    async def _stream_image(self, response, write_image: ImageWriter) -> ExternalResponse:
+        """Decode the image from the response body while it is received, and write it by chunks"""
+        decoder = Base64ImageDecoder()
+
+        async def decode() -> AsyncIterator[bytes]:
+            async for chunk in response.iter_bytes():
+                if body := decoder.feed(chunk):
+                    yield body
+
+        decoded = decode()
+        first_chunk = await anext(decoded, None)
+        size = 0
+        if first_chunk is not None:
+            async def image_chunks() -> AsyncIterator[bytes]:
+                yield first_chunk
+                async for body in decoded:
+                    yield body
+
+            size = await write_image(image_chunks())
+        else:
+            async for _ in decoded:
+                pass
+        body = decoder.close()
+
+        logger.debug(f"Get image response: size={size} usage={body.get('usage')}")
+        data = body.get("data") or [{}]
+        return ExternalResponse(
+            content=data[0].get("url"),
+            image_size=size or None,
+            remaining_requests=response.headers.get("x-ratelimit-remaining-requests"),
+            remaining_tokens=response.headers.get("x-ratelimit-remaining-tokens"),
+            reset_in=response.headers.get("x-ratelimit-reset-requests"),
+        )
+
     async def generate_image2image(
-        self, request: ExternalImage2ImageTaskSchema
+        self, request: ExternalImage2ImageTaskSchema, write_image: ImageWriter
     ) -> ExternalResponse:
         images = request.images
         for image in images:
             image.name = "tmp.png"
-        raw_response = await self.client.images.with_raw_response.edit(
+        async with self.client.images.with_streaming_response.edit(
             model="gpt-image-1",
             prompt=request.prompt,
             image=images,
             quality=request.quality.value,
             size=request.size.value,
             n=1,
-        )
-        response = raw_response.parse()
-
-        logger.debug(f"Get image response for: {request=} {response.usage}")
-        return ExternalResponse(
-            content=response.data[0].b64_json if response.data else None,
-            remaining_requests=raw_response.headers.get("x-ratelimit-remaining-requests"),
-            remaining_tokens=raw_response.headers.get("x-ratelimit-remaining-tokens"),
-            reset_in=raw_response.headers.get("x-ratelimit-reset-requests"),
-        )
+        ) as response:
+            return await self._stream_image(response, write_image)
 
     async def generate_text2image(
-        self, request: ExternalText2ImageTaskSchema
+        self, request: ExternalText2ImageTaskSchema, write_image: ImageWriter
     ) -> ExternalResponse:
-        raw_response = await self.client.images.with_raw_response.generate(
+        async with self.client.images.with_streaming_response.generate(
             model="gpt-image-1",
             prompt=request.prompt,
             size=request.size.value,
             n=1,
-        )
-        response = raw_response.parse()
-
-        logger.debug(f"Get image response for: {request=} {response.usage}")
-        return ExternalResponse(
-            content=response.data[0].b64_json if response.data else None,
-            remaining_requests=raw_response.headers.get("x-ratelimit-remaining-requests"),
-            remaining_tokens=raw_response.headers.get("x-ratelimit-remaining-tokens"),
-            reset_in=raw_response.headers.get("x-ratelimit-reset-requests"),
-        )
+        ) as response:
+            return await self._stream_image(response, write_image)
@@ -1,8 +1,10 @@
 from sqlalchemy_service import BaseService as BaseRepository
-from sqlalchemy import select
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
 from uuid import UUID
+import hashlib
 
-from app.db.tables import Prompt, engine
+from app.db.tables import Prompt, PromptImage, engine
 
 
 class PromptRepository[Table: Prompt, int](BaseRepository):
@@ -34,9 +36,27 @@ class PromptRepository[Table: Prompt, int](BaseRepository):
         await self._delete(model_id)
 
     async def get_image(self, model_id: UUID) -> bytes | None:
-        query = select(Prompt.image).filter_by(id=model_id)
+        query = select(PromptImage.body).filter_by(prompt_id=model_id)
         return await self.session.scalar(query)
 
+    async def get_image_etag(self, model_id: UUID) -> str | None:
+        query = select(PromptImage.etag).filter_by(prompt_id=model_id)
+        return await self.session.scalar(query)
+
+    async def set_image(self, model_id: UUID, body: bytes | None):
+        """Replace prompt image, or delete it if body is None"""
+        if body is None:
+            await self.session.execute(delete(PromptImage).filter_by(prompt_id=model_id))
+        else:
+            etag = hashlib.md5(body).hexdigest()
+            query = (
+                insert(PromptImage)
+                .values(prompt_id=model_id, body=body, etag=etag)
+                .on_conflict_do_update(index_elements=[PromptImage.prompt_id], set_={"body": body, "etag": etag})
+            )
+            await self.session.execute(query)
+        await self._commit()
+
     async def get_video_basic(self) -> Prompt:
         query = select(Prompt).filter_by(is_model=False, for_image=False, for_video=True).limit(1)
         model = await self.session.scalar(query)
@@ -0,0 +1,228 @@
+from aiohttp import ClientSession, ClientTimeout
+from typing import AsyncIterable, AsyncIterator, Mapping
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+import datetime as dt
+import hashlib
+import hmac
+import mimetypes
+import os
+
+from app.repositories.storage import StorageError, StorageRepository
+
+xml_namespace = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+
+
+def _quote(value: str, safe: str = "-_.~") -> str:
+    return quote(value, safe=safe)
+
+
+class S3StorageRepository(StorageRepository):
+    """
+    Files storage in an S3-compatible bucket (AWS S3, MinIO, ...), with path-style addressing
+    and Signature V4 requests over the shared aiohttp session.
+    Clients download files by presigned URLs, or by S3_PUBLIC_URL (e.g. a CDN) if it is set.
+    Presigned URLs expire, so only the public ones are permanent.
+    """
+    direct_urls = True
+    endpoint_url = os.getenv("S3_ENDPOINT_URL", "https://s3.amazonaws.com").rstrip("/")
+    region = os.getenv("S3_REGION", "us-east-1")
+    bucket = os.getenv("S3_BUCKET", "")
+    access_key_id = os.getenv("S3_ACCESS_KEY_ID", "")
+    secret_access_key = os.getenv("S3_SECRET_ACCESS_KEY", "")
+    prefix = os.getenv("S3_PREFIX", "")
+    public_url = os.getenv("S3_PUBLIC_URL", "").rstrip("/")
+    presign_expires = int(os.getenv("S3_PRESIGN_EXPIRES", str(7 * 24 * 60 * 60)))
+    part_size = int(os.getenv("S3_PART_SIZE", str(8 * 1024 * 1024)))
+    timeout = float(os.getenv("S3_TIMEOUT", "60"))
+
+    _session: ClientSession | None = None
+
+    @classmethod
+    def get_session(cls) -> ClientSession:
+        if cls._session is None or cls._session.closed:
+            cls._session = ClientSession(timeout=ClientTimeout(total=cls.timeout))
+        return cls._session
+
+    @classmethod
+    async def close(cls):
+        if cls._session is not None:
+            await cls._session.close()
+            cls._session = None
+
+    def _path(self, filename: str = "") -> str:
+        path = f"/{self.bucket}"
+        if filename:
+            path += "/" + _quote(self.prefix + filename, safe="-_.~/")
+        return path
+
+    @staticmethod
+    def _content_type(filename: str) -> str:
+        if filename.endswith(".dataurl"):
+            return "text/plain"
+        return mimetypes.guess_type(filename)[0] or "image/png"
+
+    def _signing_key(self, date: str) -> bytes:
+        key = ("AWS4" + self.secret_access_key).encode()
+        for message in (date, self.region, "s3", "aws4_request"):
+            key = hmac.new(key, message.encode(), hashlib.sha256).digest()
+        return key
+
+    def _signature(
+        self, method: str, path: str, query: dict[str, str], headers: dict[str, str], payload_hash: str, now: dt.datetime
+    ) -> str:
+        canonical_query = "&".join(f"{_quote(key)}={_quote(value)}" for key, value in sorted(query.items()))
+        canonical_headers = "".join(f"{name}:{headers[name].strip()}\n" for name in sorted(headers))
+        canonical_request = "\n".join([
+            method, path, canonical_query, canonical_headers, ";".join(sorted(headers)), payload_hash
+        ])
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            now.strftime("%Y%m%dT%H%M%SZ"),
+            f"{now:%Y%m%d}/{self.region}/s3/aws4_request",
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+        return hmac.new(self._signing_key(f"{now:%Y%m%d}"), string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    async def _request(
+        self,
+        method: str,
+        filename: str = "",
+        query: dict[str, str] | None = None,
+        body: bytes = b"",
+        headers: dict[str, str] | None = None,
+        allow_not_found: bool = False,
+    ) -> tuple[int, Mapping[str, str], bytes]:
+        """Signed request. Return status, headers and body. Raise StorageError on error status"""
+        query = query or {}
+        now = dt.datetime.now(dt.timezone.utc)
+        path = self._path(filename)
+        payload_hash = hashlib.sha256(body).hexdigest()
+        signed_headers = {
+            **{name.lower(): value for name, value in (headers or {}).items()},
+            "host": urlsplit(self.endpoint_url).netloc,
+            "x-amz-content-sha256": payload_hash,
+            "x-amz-date": now.strftime("%Y%m%dT%H%M%SZ"),
+        }
+        signature = self._signature(method, path, query, signed_headers, payload_hash, now)
+        signed_headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key_id}/{now:%Y%m%d}/{self.region}/s3/aws4_request, "
+            f"SignedHeaders={';'.join(sorted(signed_headers))}, Signature={signature}"
+        )
+        url = self.endpoint_url + path
+        if query:
+            url += "?" + "&".join(f"{_quote(key)}={_quote(value)}" for key, value in sorted(query.items()))
+
+        async with self.get_session().request(
+            method, url, data=body or None, headers=signed_headers, skip_auto_headers=["Content-Type"]
+        ) as response:
+            content = await response.read()
+            if response.status == 404 and allow_not_found:
+                return response.status, response.headers, content
+            if response.status >= 300:
+                raise StorageError(f"S3 {method} {filename or self.bucket}: {response.status} {content[:500]!r}")
+            return response.status, response.headers, content
+
+    async def store_file(self, filename: str, file_body: bytes):
+        await self._request(
+            "PUT", filename, body=file_body, headers={"content-type": self._content_type(filename)}
+        )
+
+    async def store_stream(self, filename: str, chunks: AsyncIterable[bytes]) -> int:
+        """Upload by parts of part_size, so at most one part is held. Small files are uploaded at once"""
+        buffer = bytearray()
+        upload_id = None
+        parts = []
+        size = 0
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                size += len(chunk)
+                if len(buffer) < self.part_size:
+                    continue
+                if upload_id is None:
+                    _, _, content = await self._request(
+                        "POST", filename, query={"uploads": ""},
+                        headers={"content-type": self._content_type(filename)},
+                    )
+                    upload_id = ElementTree.fromstring(content).findtext(f"{xml_namespace}UploadId")
+                parts.append(await self._upload_part(filename, upload_id, len(parts) + 1, bytes(buffer)))
+                buffer.clear()
+
+            if upload_id is None:
+                await self.store_file(filename, bytes(buffer))
+                return size
+            if buffer:
+                parts.append(await self._upload_part(filename, upload_id, len(parts) + 1, bytes(buffer)))
+            completion = "".join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+                for number, etag in enumerate(parts, start=1)
+            )
+            await self._request(
+                "POST", filename, query={"uploadId": upload_id},
+                body=f"<CompleteMultipartUpload>{completion}</CompleteMultipartUpload>".encode(),
+            )
+        except BaseException:
+            if upload_id is not None:
+                await self._request("DELETE", filename, query={"uploadId": upload_id}, allow_not_found=True)
+            raise
+        return size
+
+    async def _upload_part(self, filename: str, upload_id: str, number: int, body: bytes) -> str:
+        _, headers, _ = await self._request(
+            "PUT", filename, query={"partNumber": str(number), "uploadId": upload_id}, body=body
+        )
+        return headers["ETag"]
+
+    async def get_file(self, filename: str) -> bytes | None:
+        status, _, content = await self._request("GET", filename, allow_not_found=True)
+        return None if status == 404 else content
+
+    async def exists(self, filename: str) -> bool:
+        status, _, _ = await self._request("HEAD", filename, allow_not_found=True)
+        return status != 404
+
+    async def delete_file(self, filename: str):
+        await self._request("DELETE", filename, allow_not_found=True)
+
+    async def get_public_url(self, filename: str) -> str | None:
+        if not self.public_url:
+            return None
+        return f"{self.public_url}/{_quote(self.prefix + filename, safe='-_.~/')}"
+
+    async def get_url(self, filename: str) -> str:
+        if self.public_url:
+            return await self.get_public_url(filename)
+
+        now = dt.datetime.now(dt.timezone.utc)
+        path = self._path(filename)
+        headers = {"host": urlsplit(self.endpoint_url).netloc}
+        query = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key_id}/{now:%Y%m%d}/{self.region}/s3/aws4_request",
+            "X-Amz-Date": now.strftime("%Y%m%dT%H%M%SZ"),
+            "X-Amz-Expires": str(self.presign_expires),
+            "X-Amz-SignedHeaders": "host",
+        }
+        query["X-Amz-Signature"] = self._signature("GET", path, query, headers, "UNSIGNED-PAYLOAD", now)
+        return self.endpoint_url + path + "?" + "&".join(
+            f"{_quote(key)}={_quote(value)}" for key, value in query.items()
+        )
+
+    async def list_names(self) -> AsyncIterator[list[tuple[str, float, float]]]:
+        query = {"list-type": "2", "prefix": self.prefix}
+        while True:
+            _, _, content = await self._request("GET", query=query)
+            result = ElementTree.fromstring(content)
+            yield [
+                (
+                    item.findtext(f"{xml_namespace}Key").removeprefix(self.prefix),
+                    dt.datetime.fromisoformat(item.findtext(f"{xml_namespace}LastModified")).timestamp(),
+                    float(item.findtext(f"{xml_namespace}Size")),
+                )
+                for item in result.iter(f"{xml_namespace}Contents")
+            ]
+            token = result.findtext(f"{xml_namespace}NextContinuationToken")
+            if not token:
+                return
+            query = {**query, "continuation-token": token}
@@ -1,26 +1,324 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import AsyncIterable, AsyncIterator
+from loguru import logger
+import asyncio
+import hashlib
 import os
+import time
+import uuid
 
+storage_backend = os.getenv("STORAGE_BACKEND", "filesystem")
 
-class StorageRepository:
+
+class StorageError(Exception):
+    pass
+
+
+class StorageRepository(ABC):
+    """
+    Files storage interface, implemented by FileStorageRepository and S3StorageRepository.
+    Use get_storage_repository() for the configured one.
+    """
+    direct_urls = False  # Whether clients download files by get_url() instead of locate()
+
+    @abstractmethod
+    async def store_file(self, filename: str, file_body: bytes):
+        pass
+
+    @abstractmethod
+    async def store_stream(self, filename: str, chunks: AsyncIterable[bytes]) -> int:
+        """Write file by chunks, without holding the whole body. Return written size"""
+
+    @abstractmethod
+    async def get_file(self, filename: str) -> bytes | None:
+        pass
+
+    @abstractmethod
+    async def exists(self, filename: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def delete_file(self, filename: str):
+        pass
+
+    async def locate(self, filename: str) -> tuple[Path, os.stat_result] | None:
+        """Local path and stat of the file to serve it. None if it is not found or direct_urls is set"""
+        return None
+
+    async def get_url(self, filename: str) -> str | None:
+        """URL to download the file directly from the storage now, if direct_urls is set. It may expire"""
+        return None
+
+    async def get_public_url(self, filename: str) -> str | None:
+        """Permanent URL of the file, which may be stored in task results, if the storage has one"""
+        return None
+
+    @abstractmethod
+    def list_names(self) -> AsyncIterator[list[tuple[str, float, float]]]:
+        """All filenames with timestamps of when they were written and sizes, in batches"""
+
+    async def delete_unused(self, min_age: float, pause_every: int, pause: float) -> int:
+        """Delete storage internal data not used anymore. Return deleted count"""
+        return 0
+
+    async def migrate_legacy(self):
+        pass
+
+    @classmethod
+    async def close(cls):
+        pass
+
+
+class FileStorageRepository(StorageRepository):
+    """
+    Files storage on the local filesystem. Blocking file operations run in a dedicated thread pool,
+    so slow volumes do not block the event loop.
+
+    Contents are stored once as blobs/<sha256 prefix>/<sha256>,
+    and every filename is a hard link to its blob in names/<filename hash prefix>/<filename>,
+    so identical files share the blob and a blob without names has one link.
+    Files of the legacy flat layout are still read until migrate_legacy() moves them.
+    """
     base_directory = Path("storage")
+    blobs_directory = base_directory / "blobs"
+    names_directory = base_directory / "names"
+    temporary_directory = base_directory / "tmp"
+    executor = ThreadPoolExecutor(
+        max_workers=int(os.getenv("STORAGE_IO_THREADS", "8")),
+        thread_name_prefix="storage",
+    )
+    migration_batch_size = int(os.getenv("STORAGE_MIGRATION_BATCH_SIZE", "500"))
+    migration_pause = float(os.getenv("STORAGE_MIGRATION_PAUSE", "1"))
 
     def __init__(self):
-        if not self.base_directory.exists():
-            os.mkdir(self.base_directory)
+        for directory in (self.blobs_directory, self.names_directory, self.temporary_directory):
+            if not directory.exists():
+                os.makedirs(directory, exist_ok=True)
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    @staticmethod
+    def _shard(digest: str) -> Path:
+        return Path(digest[:2]) / digest[2:4]
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blobs_directory / self._shard(digest) / digest
+
+    def _name_path(self, filename: str) -> Path:
+        digest = hashlib.sha1(filename.encode()).hexdigest()
+        return self.names_directory / self._shard(digest) / filename
 
-    def store_file(self, filename: str, file_body: bytes):
-        with open(self.base_directory / filename, "wb") as f:
+    def _legacy_path(self, filename: str) -> Path:
+        return self.base_directory / filename
+
+    def _temporary_path(self) -> Path:
+        return self.temporary_directory / uuid.uuid4().hex
+
+    def _link(self, blob_path: Path, filename: str):
+        """Point filename to the blob, replacing the previous content atomically"""
+        name_path = self._name_path(filename)
+        name_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self._temporary_path()
+        os.link(blob_path, temporary_path)
+        temporary_path.replace(name_path)
+
+    def _store_blob(self, temporary_path: Path, digest: str, filename: str):
+        """Link filename to the blob with the same content if it is stored already, else make the file the blob"""
+        blob_path = self._blob_path(digest)
+        try:
+            self._link(blob_path, filename)
+            temporary_path.unlink()
+        except FileNotFoundError:
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path.replace(blob_path)
+            self._link(blob_path, filename)
+
+    def _write(self, filename: str, file_body: bytes):
+        temporary_path = self._temporary_path()
+        with open(temporary_path, "wb") as f:
             f.write(file_body)
+        self._store_blob(temporary_path, hashlib.sha256(file_body).hexdigest(), filename)
+
+    def _locate(self, filename: str) -> tuple[Path, os.stat_result] | None:
+        for path in (self._name_path(filename), self._legacy_path(filename)):
+            try:
+                return path, os.stat(path)
+            except FileNotFoundError:
+                continue
+        return None
+
+    def _read(self, filename: str) -> bytes | None:
+        for path in (self._name_path(filename), self._legacy_path(filename)):
+            try:
+                with open(path, "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                continue
+        return None
+
+    def _delete(self, filename: str):
+        """Blob without other names is left for the storage garbage collection"""
+        self._name_path(filename).unlink(missing_ok=True)
+        self._legacy_path(filename).unlink(missing_ok=True)
+
+    @staticmethod
+    def _hash_file(path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _migrate_legacy_batch(self) -> int:
+        """Move up to a batch of flat layout files. Return count of moved files"""
+        migrated = 0
+        with os.scandir(self.base_directory) as entries:
+            for entry in entries:
+                if migrated >= self.migration_batch_size:
+                    break
+                if not entry.is_file(follow_symlinks=False) or entry.name.endswith(".tmp"):
+                    continue
+                legacy_path = Path(entry.path)
+                try:
+                    if not self._name_path(entry.name).exists():  # Else it was written again already
+                        temporary_path = self._temporary_path()
+                        os.link(legacy_path, temporary_path)
+                        self._store_blob(temporary_path, self._hash_file(legacy_path), entry.name)
+                    legacy_path.unlink()
+                except FileNotFoundError:  # Moved by another process
+                    continue
+                migrated += 1
+        return migrated
+
+    @staticmethod
+    def _list_shards(directory: Path) -> list[Path]:
+        return sorted(
+            Path(second.path)
+            for first in os.scandir(directory) if first.is_dir()
+            for second in os.scandir(first.path) if second.is_dir()
+        )
+
+    @staticmethod
+    def _list_names(shard: Path) -> list[tuple[str, float, float]]:
+        """
+        Filenames with link times and sizes.
+        Modification time is of the blob, which may be written long before the name is linked,
+        while linking updates the change time. Size of a shared blob is split between its names.
+        """
+        names = []
+        with os.scandir(shard) as entries:
+            for entry in entries:
+                try:
+                    stat_result = entry.stat()
+                except FileNotFoundError:
+                    continue
+                names.append((entry.name, stat_result.st_ctime, stat_result.st_size / max(stat_result.st_nlink - 1, 1)))
+        return names
+
+    @staticmethod
+    def _delete_orphan_blobs(shard: Path, min_age: float) -> tuple[int, int]:
+        """
+        Delete blobs, which have no names and are older than min_age seconds.
+        Return counts of scanned and deleted blobs
+        """
+        scanned = deleted = 0
+        now = time.time()
+        with os.scandir(shard) as entries:
+            for entry in entries:
+                scanned += 1
+                try:
+                    stat_result = entry.stat()
+                    if stat_result.st_nlink == 1 and now - stat_result.st_mtime > min_age:
+                        os.unlink(entry.path)
+                        deleted += 1
+                except FileNotFoundError:
+                    continue
+        return scanned, deleted
+
+    def _delete_stale_temporary(self, min_age: float) -> int:
+        deleted = 0
+        now = time.time()
+        paths = [*self.temporary_directory.iterdir(), *self.base_directory.glob("*.tmp")]
+        for path in paths:
+            try:
+                if now - path.stat().st_mtime > min_age:
+                    path.unlink()
+                    deleted += 1
+            except FileNotFoundError:
+                continue
+        return deleted
+
+    async def store_file(self, filename: str, file_body: bytes):
+        await self._run(self._write, filename, file_body)
+
+    async def store_stream(self, filename: str, chunks: AsyncIterable[bytes]) -> int:
+        """Write file by chunks, without holding the whole body. Return written size"""
+        temporary_path = self._temporary_path()
+        f = await self._run(open, temporary_path, "wb")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async for chunk in chunks:
+                await self._run(f.write, chunk)
+                digest.update(chunk)
+                size += len(chunk)
+        except BaseException:
+            await self._run(f.close)
+            await self._run(temporary_path.unlink, True)
+            raise
+        await self._run(f.close)
+        await self._run(self._store_blob, temporary_path, digest.hexdigest(), filename)
+        return size
+
+    async def get_file(self, filename: str) -> bytes | None:
+        return await self._run(self._read, filename)
+
+    async def locate(self, filename: str) -> tuple[Path, os.stat_result] | None:
+        """Path and stat of the file to serve it, or None if it is not found"""
+        return await self._run(self._locate, filename)
+
+    async def stat(self, filename: str) -> os.stat_result | None:
+        location = await self.locate(filename)
+        return location[1] if location is not None else None
+
+    async def exists(self, filename: str) -> bool:
+        return await self.locate(filename) is not None
+
+    async def delete_file(self, filename: str):
+        await self._run(self._delete, filename)
+
+    async def list_names(self) -> AsyncIterator[list[tuple[str, float, float]]]:
+        for shard in await self._run(self._list_shards, self.names_directory):
+            yield await self._run(self._list_names, shard)
+
+    async def delete_unused(self, min_age: float, pause_every: int, pause: float) -> int:
+        """Delete blobs left without names and temporary files left by interrupted writes"""
+        deleted = not_paused = 0
+        for shard in await self._run(self._list_shards, self.blobs_directory):
+            shard_scanned, shard_deleted = await self._run(self._delete_orphan_blobs, shard, min_age)
+            deleted += shard_deleted
+            not_paused += shard_scanned
+            if not_paused >= pause_every:
+                not_paused = 0
+                await asyncio.sleep(pause)
+        return deleted + await self._run(self._delete_stale_temporary, min_age)
 
-    def get_file(self, filename: str) -> bytes | None:
-        if not (self.base_directory / filename).exists():
-            return None
-        with open(self.base_directory / filename, "rb") as f:
-            return f.read()
+    async def migrate_legacy(self):
+        """
+        Move files of the flat layout to the blobs in batches, while the storage is in use.
+        Files are readable during the move, as the name is linked before the flat file is removed.
+        """
+        while migrated := await self._run(self._migrate_legacy_batch):
+            logger.info(f"Moved {migrated} files to the sharded storage layout")
+            await asyncio.sleep(self.migration_pause)
 
-    def exists(self, filename: str) -> bool:
-        return (self.base_directory / filename).exists()
 
-    def delete_file(self, filename: str):
-        (self.base_directory / filename).unlink()
+def get_storage_repository() -> StorageRepository:
+    """Storage of the STORAGE_BACKEND: filesystem (default) or s3"""
+    if storage_backend == "s3":
+        from app.repositories.s3_storage import S3StorageRepository
+        return S3StorageRepository()
+    return FileStorageRepository()
@@ -1,12 +1,14 @@
 from contextlib import suppress
+import datetime as dt
 from fastapi import Response, HTTPException
 from loguru import logger
-from sqlalchemy import exc
+from sqlalchemy import exc, or_, select, update
+from sqlalchemy.orm import noload, selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy_service import BaseService as BaseRepository
 from uuid import UUID
 
-from app.db.tables import Task, TaskItem, engine
+from app.db.tables import Task, TaskItem, engine, sql_utcnow
 
 
 class TaskRepository[Table: Task, int](BaseRepository):
@@ -60,6 +62,35 @@ class TaskRepository[Table: Task, int](BaseRepository):
     async def list(self, page=None, count=None) -> list[Task]:
         return list(await self._get_list(page=page, count=count))
 
+    async def list_by_ids(self, ids: "list[UUID]", changed_since: dt.datetime | None = None) -> "list[Task]":
+        """Tasks with their items in two queries, optionally only changed since the time"""
+        query = (
+            select(Task)
+            .filter(Task.id.in_(ids))
+            .options(selectinload(Task.items), noload(Task.images))
+        )
+        if changed_since is not None:
+            query = query.filter(or_(Task.created_at >= changed_since, Task.updated_at >= changed_since))
+        return list(await self.session.scalars(query))
+
+    async def touch(self, model_id: UUID):
+        """Mark task as changed, e.g. when items are added"""
+        query = (
+            update(Task)
+            .where(Task.id == model_id)
+            .values(updated_at=sql_utcnow)
+            .execution_options(synchronize_session=False)
+        )
+        await self.session.execute(query)
+
+    async def list_result_urls(self, task_ids: "list[UUID]") -> "list[tuple[UUID, str | None]]":
+        query = select(TaskItem.task_id, TaskItem.result_url).filter(TaskItem.task_id.in_(task_ids))
+        return [tuple(row) for row in await self.session.execute(query)]
+
+    async def release(self):
+        """End the current transaction, so the connection returns to the pool, e.g. while waiting"""
+        await self.session.rollback()
+
     async def get(self, model_id: UUID) -> Task:
         return await self._get_one(
             id=model_id,
@@ -1,11 +1,13 @@
 from contextlib import suppress
+import datetime as dt
 from fastapi import Response, HTTPException
 from loguru import logger
-from sqlalchemy import exc
+from sqlalchemy import and_, case, delete, exc, func, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy_service import BaseService as BaseRepository
+from uuid import UUID
 
-from app.db.tables import TaskRequest, engine
+from app.db.tables import TaskRequest, engine, sql_utcnow
 
 
 class TaskRequestRepository[Table: TaskRequest, int](BaseRepository):
@@ -40,12 +42,86 @@ class TaskRequestRepository[Table: TaskRequest, int](BaseRepository):
     async def create(self, **fields) -> TaskRequest:
         return await self._create(**fields)
 
-    async def list(self, not_sended: bool | None = None, page=None, count=None) -> list[TaskRequest]:
+    @staticmethod
+    def _claimable():
+        """Filter for requests that are not sended or whose lease is expired"""
+        return or_(
+            TaskRequest.status == None,
+            and_(
+                TaskRequest.status == "sended",
+                or_(TaskRequest.lease_expires_at == None, TaskRequest.lease_expires_at < sql_utcnow),
+            ),
+        )
+
+    async def claim(
+        self, owner: str, lease_seconds: float, lane: str | None = None, count: int = 1
+    ) -> list[TaskRequest]:
+        """
+        Atomically lease up to count claimable requests to the owner.
+        Rows locked by another worker's claim are skipped.
+        """
+        candidates = (
+            select(TaskRequest.id)
+            .filter(self._claimable())
+            .order_by(TaskRequest.created_at.asc())
+            .limit(count)
+            .with_for_update(skip_locked=True)
+        )
+        if lane is not None:
+            candidates = candidates.filter(TaskRequest.lane == lane)
+        query = (
+            update(TaskRequest)
+            .where(TaskRequest.id.in_(candidates))
+            .values(
+                status="sended",
+                lease_owner=owner,
+                lease_expires_at=sql_utcnow + dt.timedelta(seconds=lease_seconds),
+            )
+            .returning(TaskRequest)
+            .execution_options(synchronize_session=False)
+        )
+        models = list(await self.session.scalars(query))
+        await self._commit()
+        return models
+
+    async def renew(self, model_id: int, owner: str, lease_seconds: float) -> bool:
+        """Extend the lease, if the owner still holds it"""
+        query = (
+            update(TaskRequest)
+            .where(TaskRequest.id == model_id, TaskRequest.lease_owner == owner)
+            .values(lease_expires_at=sql_utcnow + dt.timedelta(seconds=lease_seconds))
+            .returning(TaskRequest.id)
+            .execution_options(synchronize_session=False)
+        )
+        renewed = (await self.session.execute(query)).first() is not None
+        await self._commit()
+        return renewed
+
+    async def finish(self, model_id: int, owner: str) -> bool:
+        """Delete the finished request, if the owner still holds its lease"""
+        query = (
+            delete(TaskRequest)
+            .where(TaskRequest.id == model_id, TaskRequest.lease_owner == owner)
+            .returning(TaskRequest.id)
+            .execution_options(synchronize_session=False)
+        )
+        return (await self.session.execute(query)).first() is not None
+
+    async def notify(self, channel: str, payload: str = ""):
+        """Send Postgres NOTIFY to the channel"""
+        await self.session.execute(select(func.pg_notify(channel, payload)))
+        await self._commit()
+
+    async def list(
+        self, not_sended: bool | None = None, lane: str | None = None, page=None, count=None
+    ) -> list[TaskRequest]:
         query = self._get_list_query(page=page, count=count)
         if not_sended:
             query = query.filter(TaskRequest.status == None)
+        if lane is not None:
+            query = query.filter(TaskRequest.lane == lane)
         query = query.order_by(TaskRequest.created_at.asc())
-        return list(await self._get_list(page=page, count=count))
+        return list(await self.session.scalars(query))
 
     async def get(self, model_id: int) -> TaskRequest:
         return await self._get_one(
@@ -58,6 +134,25 @@ class TaskRequestRepository[Table: TaskRequest, int](BaseRepository):
     async def delete(self, model_id: int):
         await self._delete(model_id)
 
+    async def list_task_ids(self, task_ids: "list[UUID]") -> "set[UUID]":
+        """Tasks of the ones given, which still have requests"""
+        query = select(TaskRequest.task_id).filter(TaskRequest.task_id.in_(task_ids))
+        return set(await self.session.scalars(query))
+
     async def count(self, status: str | None = None):
         return await self._count(status=status)
 
+    async def count_by_lane(self) -> "list[tuple[str, str, int, dt.datetime]]":
+        """
+        Return (lane, state, count, oldest created_at) for every lane and state.
+        State is 'queued' for claimable requests and 'sended' for leased ones.
+        """
+        state = case((self._claimable(), "queued"), else_="sended")
+        query = select(
+            TaskRequest.lane,
+            state,
+            func.count(),
+            func.min(TaskRequest.created_at),
+        ).group_by(TaskRequest.lane, state)
+        return [tuple(row) for row in await self.session.execute(query)]
+
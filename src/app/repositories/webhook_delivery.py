@@ -0,0 +1,103 @@
+import datetime as dt
+from fastapi import Response, HTTPException
+from loguru import logger
+from sqlalchemy import delete, exc, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy_service import BaseService as BaseRepository
+
+from app.db.tables import WebhookDelivery, engine, sql_utcnow
+
+
+class WebhookDeliveryRepository[Table: WebhookDelivery, int](BaseRepository):
+    base_table = WebhookDelivery
+    engine = engine
+    session: AsyncSession
+    response: Response
+
+    async def _commit(self, force: bool = False):
+        """
+        Commit changes.
+        Handle sqlalchemy.exc.IntegrityError.
+        If exception is not found error,
+        then throw HTTPException with 404 status (Not found).
+        Else log exception and throw HTTPException with 409 status (Conflict)
+        """
+        try:
+            await self.session.commit()
+        except exc.IntegrityError as e:
+            await self.session.rollback()
+            if 'is not present in table' not in str(e.orig):
+                logger.exception(e)
+                raise HTTPException(status_code=409)
+            table_name = str(e.orig).split('is not present in table')[1]
+            table_name = table_name.strip().capitalize()
+            table_name = table_name.strip('"').strip("'")
+            raise HTTPException(
+                status_code=404,
+                detail=f'{table_name} not found'
+            )
+
+    async def create(self, **fields) -> WebhookDelivery:
+        return await self._create(**fields)
+
+    async def claim_due(self, lease_seconds: float, count: int) -> list[WebhookDelivery]:
+        """
+        Atomically take up to count pending deliveries which are due,
+        and postpone them by the lease, so other workers skip them meanwhile.
+        """
+        candidates = (
+            select(WebhookDelivery.id)
+            .filter(WebhookDelivery.status == None, WebhookDelivery.next_attempt_at <= sql_utcnow)
+            .order_by(WebhookDelivery.next_attempt_at.asc())
+            .limit(count)
+            .with_for_update(skip_locked=True)
+        )
+        query = (
+            update(WebhookDelivery)
+            .where(WebhookDelivery.id.in_(candidates))
+            .values(next_attempt_at=sql_utcnow + dt.timedelta(seconds=lease_seconds))
+            .returning(WebhookDelivery)
+            .execution_options(synchronize_session=False)
+        )
+        models = list(await self.session.scalars(query))
+        await self._commit()
+        return models
+
+    async def retry_later(self, model_id: int, delay: float, error: str):
+        query = (
+            update(WebhookDelivery)
+            .where(WebhookDelivery.id == model_id)
+            .values(
+                attempts=WebhookDelivery.attempts + 1,
+                next_attempt_at=sql_utcnow + dt.timedelta(seconds=delay),
+                last_error=error,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        await self.session.execute(query)
+
+    async def delete_failed(self, retention_seconds: float) -> int:
+        """Delete deliveries which failed longer than retention_seconds ago. Return deleted count"""
+        failed_at = func.coalesce(WebhookDelivery.updated_at, WebhookDelivery.created_at)
+        query = (
+            delete(WebhookDelivery)
+            .where(
+                WebhookDelivery.status == "failed",
+                failed_at < sql_utcnow - dt.timedelta(seconds=retention_seconds),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.session.execute(query)
+        await self._commit()
+        return result.rowcount
+
+    async def get(self, model_id: int) -> WebhookDelivery:
+        return await self._get_one(
+            id=model_id,
+        )
+
+    async def update(self, model_id: int, **fields) -> WebhookDelivery:
+        return await self._update(model_id, **fields)
+
+    async def delete(self, model_id: int):
+        await self._delete(model_id)
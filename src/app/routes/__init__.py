@@ -1,9 +1,17 @@
 import os
-from fastapi import Header, HTTPException
+from fastapi import Header, HTTPException, Request
 
 api_tokens = os.getenv("API_TOKEN", "123").split(',')
 
 
+def is_not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
 def validate_api_token(api_token: str = Header()):
     if api_token not in api_tokens:
         raise HTTPException(401)
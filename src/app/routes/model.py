@@ -1,12 +1,15 @@
-from fastapi import APIRouter, Depends, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from uuid import UUID
 
-from app.routes import validate_api_token
+from app.routes import is_not_modified, validate_api_token
 from app.schemas.model import ModelSearchSchema, ModelSchema
 from app.services.model import ModelService
 
 router = APIRouter(prefix="/api/model", tags=["Model"])
 
+# Images may be replaced in the admin panel, so clients revalidate them by ETag
+MODEL_IMAGE_CACHE_CONTROL = "public, max-age=3600"
+
 
 @router.get(
     "",
@@ -24,6 +27,22 @@ async def list_models(
     "/{model_id}/image",
     response_class=Response
 )
-async def get_model_image(model_id: UUID, service: ModelService = Depends()):
-    image = await service.get_image(model_id)
-    return Response(content=image, media_type="image/png")
+async def get_model_image(
+        model_id: UUID,
+        request: Request,
+        size: int | None = Query(None, ge=16, le=1024, description="Thumbnail size, fits into size x size. Rounded up to a supported size"),
+        service: ModelService = Depends()
+):
+    size = service.get_image_size(size)
+    image_etag = await service.get_image_etag(model_id)
+    if image_etag is None:
+        raise HTTPException(404)
+    etag = f'"{image_etag}-{size}"' if size else f'"{image_etag}"'
+    headers = {"etag": etag, "cache-control": MODEL_IMAGE_CACHE_CONTROL}
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    image = await service.get_image(model_id, image_etag, size)
+    if image is None:
+        raise HTTPException(404)
+    return Response(content=image, media_type="image/png", headers=headers)
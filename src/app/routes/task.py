@@ -1,22 +1,44 @@
 from io import BytesIO
 from PIL import Image
-from fastapi import APIRouter, BackgroundTasks, Depends, File, UploadFile, HTTPException
-from fastapi.responses import Response
+from fastapi import APIRouter, BackgroundTasks, Depends, File, Query, Request, UploadFile
+from fastapi.responses import FileResponse, RedirectResponse, Response, StreamingResponse
+from typing import Literal
 from uuid import UUID
 
-from app.schemas.task import TaskImageCreateSchema, TaskSchema, TaskShortSchema, TaskStatisticsSchema, TaskTextCreateSchema
+from app.schemas.task import TaskBatchSchema, TaskImageCreateSchema, TaskLaneSchema, TaskSchema, TaskShortSchema, TaskStatisticsSchema, TaskTextCreateSchema
 from app.services.context import ContextService
+from app.services.result_variants import result_variants
 from app.services.task import TaskService
-from . import validate_api_token
+from . import is_not_modified, validate_api_token
 
 router = APIRouter(prefix="/api/task", tags=["Task"])
 
+# Result files never change after they are written
+RESULT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Original PNG served instead of a variant, which is not made yet
+RESULT_FALLBACK_CACHE_CONTROL = "no-cache"
+# Redirects to the storage URLs, which may expire
+RESULT_REDIRECT_CACHE_CONTROL = "private, max-age=300"
+MAX_WAIT_SECONDS = 60
+EVENTS_HEARTBEAT_SECONDS = 15
+EVENTS_MAX_DURATION_SECONDS = 600
+
 
 @router.get("/statistics", response_model=TaskStatisticsSchema, dependencies=[Depends(validate_api_token)])
 def get_api_statistics(service: TaskService = Depends()):
     return service.get_statistics()
 
 
+@router.get("/lanes", response_model=list[TaskLaneSchema], dependencies=[Depends(validate_api_token)])
+async def get_lanes_statistics(service: TaskService = Depends()):
+    return await service.get_lanes_statistics()
+
+
+@router.post("/batch", response_model=list[TaskSchema], dependencies=[Depends(validate_api_token)])
+async def get_tasks_batch(schema: TaskBatchSchema, service: TaskService = Depends()):
+    return await service.get_many(schema)
+
+
 @router.post("/image", response_model=TaskShortSchema, dependencies=[Depends(validate_api_token)])
 async def create_task_image2image(
     background_tasks: BackgroundTasks,
@@ -53,13 +75,44 @@ async def create_task_text2text(
 
 
 @router.get("/{task_id}", response_model=TaskSchema, dependencies=[Depends(validate_api_token)])
-async def get_task(task_id: UUID, service: TaskService = Depends()):
-    return await service.get(task_id)
+async def get_task(
+    task_id: UUID,
+    wait: float = Query(0, ge=0, le=MAX_WAIT_SECONDS, description="Seconds to wait for the task to finish"),
+    service: TaskService = Depends(),
+):
+    return await service.wait(task_id, wait)
+
+
+@router.get("/{task_id}/events", response_class=StreamingResponse, dependencies=[Depends(validate_api_token)])
+async def get_task_events(task_id: UUID, service: TaskService = Depends()):
+    await service.get(task_id)
+    return StreamingResponse(
+        TaskService.stream_events(task_id, EVENTS_HEARTBEAT_SECONDS, EVENTS_MAX_DURATION_SECONDS),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+    )
 
 
-@router.get("/{task_id}/result", response_class=Response)
-def get_task_result(task_id: UUID, service: TaskService = Depends()):
-    content = service.get_result(task_id)
-    if content is None:
-        raise HTTPException(404)
-    return Response(content=content, media_type="image/png")
+@router.get("/{task_id}/result", response_class=FileResponse)
+async def get_task_result(
+    task_id: UUID,
+    request: Request,
+    format: Literal["png", "webp", "avif"] | None = Query(None, description="By default is negotiated on Accept"),
+    size: int | None = Query(None, gt=0, description="Thumbnail size, the nearest larger one is returned"),
+    service: TaskService = Depends(),
+):
+    headers = {"cache-control": RESULT_CACHE_CONTROL}
+    if format is None:
+        format = result_variants.negotiate_format(request.headers.get("accept"))
+        headers["vary"] = "accept"
+    path, stat_result, media_type, exact = await service.get_result(task_id, format, size)
+    if stat_result is None:
+        headers["cache-control"] = RESULT_REDIRECT_CACHE_CONTROL
+    if not exact:
+        headers["cache-control"] = RESULT_FALLBACK_CACHE_CONTROL
+    if stat_result is None:
+        return RedirectResponse(path, status_code=307, headers=headers)
+    response = FileResponse(path, media_type=media_type, stat_result=stat_result, headers=headers)
+    if is_not_modified(request, response.headers["etag"]):
+        return Response(status_code=304, headers={"etag": response.headers["etag"], **headers})
+    return response
@@ -44,6 +44,11 @@ class ContextBuildedEntity(BaseModel):
     content: str
 
 
+class ContextBudget(BaseModel):
+    max_tokens: int
+    max_images: int
+
+
 class ContextBuilded(BaseModel):
     entities: list[ContextBuildedEntity]
     images_filenames: list[str]
@@ -58,6 +58,7 @@ class ExternalText2TextTaskSchema(BaseModel):
 
 class ExternalResponse(BaseModel):
     content: str | None = None
+    image_size: int | None = None
     remaining_requests: int | None = None
     remaining_tokens: int | None = None
     reset_in: str | None = None
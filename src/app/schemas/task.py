@@ -1,4 +1,5 @@
 from uuid import UUID
+import datetime as dt
 import json
 from fastapi import Form, HTTPException
 from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
@@ -133,6 +134,27 @@ class TaskImageCreateSchema(_TaskCreateSchema):
         )
 
 
+class TaskBatchSchema(BaseModel):
+    ids: list[UUID] = Field(min_length=1, max_length=100)
+    changed_since: dt.datetime | None = Field(
+        default=None,
+        description="Return only tasks created or changed since the time (UTC if timezone is not set)",
+    )
+
+
+class TaskLaneSchema(BaseModel):
+    name: str
+    concurrency: int
+    queued: int = 0
+    in_flight: int = 0
+    wait_seconds: float = 0
+
+
 class TaskStatisticsSchema(BaseModel):
     remaining_tokens: int
     remaining_requests: int
+    concurrency_limit: int
+    image_queue_depth: int = 0
+    image_processed: int = 0
+    image_average_seconds: float = 0
+    image_average_wait_seconds: float = 0
@@ -0,0 +1,80 @@
+import os
+import re
+import time
+from loguru import logger
+
+from app.db.tables import db_pool_size, db_reserved_connections, sessions_per_request
+from app.schemas.external import ExternalResponse
+
+
+def parse_reset_in(value: str | None) -> float | None:
+    """Parse OpenAI reset header value (like '1s', '6m0s', '20ms') to seconds"""
+    if not value:
+        return None
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    multipliers = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * multipliers[unit] for number, unit in parts)
+
+
+class ConcurrencyController:
+    """
+    Size the window of in-flight OpenAI requests from the rate limit headers.
+    Additive increase while there is headroom, halving when the limit
+    is nearly used up or a request is rate limited.
+    """
+    floor = int(os.getenv("OPENAI_CONCURRENCY_MIN", "1"))
+    ceiling = int(os.getenv("OPENAI_CONCURRENCY_MAX", "16"))
+    # In-flight requests over the database pool would wait for connections while holding others
+    pool_ceiling = max((db_pool_size - db_reserved_connections) // sessions_per_request, 1)
+    initial = int(os.getenv("OPENAI_CONCURRENCY_INITIAL", "3"))
+    min_remaining_tokens = int(os.getenv("OPENAI_CONCURRENCY_MIN_TOKENS", "20000"))
+
+    def __init__(self):
+        if self.ceiling > self.pool_ceiling:
+            logger.warning(
+                f"OPENAI_CONCURRENCY_MAX={self.ceiling} is over the database pool capacity, "
+                f"using {self.pool_ceiling}. Increase DB_POOL_SIZE to allow more"
+            )
+            self.ceiling = self.pool_ceiling
+        self.floor = min(self.floor, self.ceiling)
+        self.limit = min(max(self.initial, self.floor), self.ceiling)
+        self.paused_until = 0.0
+
+        self.remaining_requests: int | None = None
+        self.remaining_tokens: int | None = None
+        self.reset_in: str | None = None
+
+    def available(self, in_flight: int) -> int:
+        if time.monotonic() < self.paused_until:
+            return 0
+        return max(self.limit - in_flight, 0)
+
+    def update(self, response: ExternalResponse):
+        if response.remaining_requests is not None:
+            self.remaining_requests = response.remaining_requests
+        if response.remaining_tokens is not None:
+            self.remaining_tokens = response.remaining_tokens
+        if response.reset_in is not None:
+            self.reset_in = response.reset_in
+
+        if self.remaining_requests is None:
+            return
+
+        if self.remaining_requests <= self.limit or (
+            self.remaining_tokens is not None
+            and self.remaining_tokens < self.min_remaining_tokens
+        ):
+            self.back_off(parse_reset_in(self.reset_in) if self.remaining_requests == 0 else None)
+        elif self.remaining_requests > self.limit * 2:
+            self.limit = min(self.limit + 1, self.ceiling)
+
+    def back_off(self, pause: float | None = None):
+        self.limit = max(self.limit // 2, self.floor)
+        if pause:
+            self.paused_until = time.monotonic() + pause
+        logger.info(f"Concurrency window reduced to {self.limit}, {pause=}")
+
+
+concurrency_controller = ConcurrencyController()
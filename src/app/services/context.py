@@ -1,16 +1,35 @@
 from enum import Enum
 from uuid import UUID
 from fastapi import Depends, HTTPException, status
+from loguru import logger
+import json
+import os
 from app.db.tables import Context, ContextEntityContentType, ContextEntityRole
 from app.repositories.context import ContextRepository
 from app.repositories.context_entity import ContextEntityRepository
-from app.schemas.context import ContextBuilded, ContextBuildedEntity, ContextCreateSchema, ContextEntitySchema, ContextSchema
+from app.schemas.context import ContextBudget, ContextBuilded, ContextBuildedEntity, ContextCreateSchema, ContextEntitySchema, ContextSchema
+
+
+# Budget of context sent with text requests. CONTEXT_BUDGETS overrides it per app_bundle,
+# like {"com.example.app": {"max_tokens": 4000, "max_images": 3}}
+default_context_budget = ContextBudget(
+    max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", "16000")),
+    max_images=int(os.getenv("CONTEXT_MAX_IMAGES", "15")),
+)
+app_context_budgets = {
+    app_bundle: ContextBudget.model_validate(default_context_budget.model_dump() | budget)
+    for app_bundle, budget in json.loads(os.getenv("CONTEXT_BUDGETS", "{}")).items()
+}
 
 
 class ContextService:
     MAX_TEXT_LENGTH = 30000
     MAX_IMAGES_COUNT = 15
 
+    default_budget = default_context_budget
+    app_budgets = app_context_budgets
+    image_tokens = int(os.getenv("CONTEXT_IMAGE_TOKENS", "765"))
+
     def __init__(
         self,
         context_repository: ContextRepository = Depends(ContextRepository.depend),
@@ -27,28 +46,21 @@ class ContextService:
 
     async def get(self, context_id: UUID) -> ContextSchema:
         model = await self.context_repository.get(context_id)
-        usage = await self._get_usage(context_id)
-        return ContextSchema.model_validate(model.__dict__ | {"text_available": self.MAX_TEXT_LENGTH - usage["text"], "images_available": self.MAX_IMAGES_COUNT - usage["images"]})
+        return ContextSchema.model_validate(model.__dict__ | {"text_available": self.MAX_TEXT_LENGTH - model.text_length, "images_available": self.MAX_IMAGES_COUNT - model.images_count})
 
     async def get_last(self, user_id: str) -> ContextSchema:
         model = await self.context_repository.get_last(user_id)
-        usage = await self._get_usage(model.id)
-        return ContextSchema.model_validate(model.__dict__ | {"text_available": self.MAX_TEXT_LENGTH - usage["text"], "images_available": self.MAX_IMAGES_COUNT - usage["images"]})
+        return ContextSchema.model_validate(model.__dict__ | {"text_available": self.MAX_TEXT_LENGTH - model.text_length, "images_available": self.MAX_IMAGES_COUNT - model.images_count})
 
     async def delete(self, context_id: UUID):
         await self.context_repository.delete(context_id)
 
-    async def _get_usage(self, context_id: UUID) -> dict[str, int]:
-        builded = await self.build_context(context_id)
-        text_length = len("".join(map(lambda i: i.content if i.content not in builded.images_filenames else '', builded.entities)))
-        images_count = len(builded.images_filenames)
-        return {"text": text_length, "images": images_count}
-
     async def add_entity_text(
         self, context_id: UUID, content: str, role: ContextEntityRole
     ) -> ContextEntitySchema:
-        usage = await self._get_usage(context_id)
-        if usage["text"] + len(content) >= self.MAX_TEXT_LENGTH:
+        text_length, _ = await self.context_repository.increase_usage(context_id, text_length=len(content))
+        if text_length >= self.MAX_TEXT_LENGTH:
+            await self.context_repository.rollback()
             raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Max context size exceed")
         model = await self.entity_repository.create(
             context_id=context_id,
@@ -61,8 +73,9 @@ class ContextService:
     async def add_entity_image(
         self, context_id: UUID, image_filename: str, role: ContextEntityRole
     ) -> ContextEntitySchema:
-        usage = await self._get_usage(context_id)
-        if usage["images"] + 1 > self.MAX_IMAGES_COUNT:
+        _, images_count = await self.context_repository.increase_usage(context_id, images_count=1)
+        if images_count > self.MAX_IMAGES_COUNT:
+            await self.context_repository.rollback()
             raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Max context size exceed")
         model = await self.entity_repository.create(
             context_id=context_id,
@@ -72,17 +85,66 @@ class ContextService:
         )
         return ContextEntitySchema.model_validate(model)
 
-    async def build_context(self, context_id: UUID) -> ContextBuilded:
-        model = await self.context_repository.get(context_id)
+    async def build_context(
+        self,
+        context_id: UUID,
+        last_count: int | None = None,
+        max_text_length: int | None = None,
+    ) -> ContextBuilded:
+        entities = await self.entity_repository.list_content(
+            context_id, last_count=last_count, max_text_length=max_text_length
+        )
         schema = ContextBuilded(entities=[], images_filenames=[])
-        for entity in model.entities:
-            if entity.content_type == ContextEntityContentType.text:
-                schema.entities.append(ContextBuildedEntity(role=entity.role, content=entity.content))
-            elif entity.content_type == ContextEntityContentType.image:
-                schema.entities.append(ContextBuildedEntity(role=entity.role, content=entity.content))
-                schema.images_filenames.append(entity.content)
+        for role, content, content_type in entities:
+            if content_type == ContextEntityContentType.text:
+                schema.entities.append(ContextBuildedEntity(role=role, content=content))
+            elif content_type == ContextEntityContentType.image:
+                schema.entities.append(ContextBuildedEntity(role=role, content=content))
+                schema.images_filenames.append(content)
         return schema
 
+    def get_budget(self, app_bundle: str) -> ContextBudget:
+        return self.app_budgets.get(app_bundle, self.default_budget)
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Local estimate of tokens count, about 4 bytes of UTF-8 per token"""
+        return len(text.encode()) // 4 + 1
+
+    def fit_to_budget(
+        self,
+        context: ContextBuilded,
+        app_bundle: str,
+        reserved_tokens: int = 0,
+        reserved_images: int = 0,
+    ) -> ContextBuilded:
+        """
+        Keep the most recent entities of the context which fit
+        in the app_bundle budget, minus tokens and images reserved for the request itself.
+        """
+        budget = self.get_budget(app_bundle)
+        tokens, images = reserved_tokens, reserved_images
+        entities = []
+        for entity in reversed(context.entities):
+            is_image = entity.content in context.images_filenames
+            cost = self.image_tokens if is_image else self.estimate_tokens(entity.content)
+            if tokens + cost > budget.max_tokens or images + is_image > budget.max_images:
+                break
+            tokens += cost
+            images += is_image
+            entities.append(entity)
+        entities.reverse()
+
+        if len(entities) < len(context.entities):
+            logger.debug(f"Dropped {len(context.entities) - len(entities)} context entities for {app_bundle=}")
+        return ContextBuilded(
+            entities=entities,
+            images_filenames=[
+                entity.content for entity in entities
+                if entity.content in context.images_filenames
+            ],
+        )
+
     async def __aenter__(self):
         self.context_repository = await ContextRepository().__aenter__()
         self.entity_repository = ContextEntityRepository(session=self.context_repository.session)
@@ -0,0 +1,97 @@
+import asyncio
+import os
+from typing import Awaitable, Callable
+from loguru import logger
+
+from app.repositories.notification import notification_listener
+
+
+class Dispatcher:
+    """
+    Run the sweep coroutine as soon as it may have work to do.
+    Woken by notify() in this process or, when channel is set, by Postgres NOTIFY
+    on the channel from other processes, with a periodic sweep as a fallback for recovery.
+    """
+
+    def __init__(
+        self,
+        sweep: Callable[[], Awaitable[None]],
+        sweep_interval: float,
+        channel: str | None = None,
+    ):
+        self.sweep = sweep
+        self.sweep_interval = sweep_interval
+        self.channel = channel
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _on_notification(self, payload: str):
+        self.notify()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.sweep_interval)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.exception(e)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._run())]
+        if self.channel is not None:
+            notification_listener.subscribe(self.channel, self._on_notification)
+        self.notify()  # Pick up work left from previous run
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+
+async def _process_requests():
+    from app.services.task import TaskService
+
+    async with TaskService() as task_service:
+        await task_service.process_requests()
+
+
+async def _deliver_webhooks():
+    from app.services.webhook import WebhookService
+
+    async with WebhookService() as webhook_service:
+        await webhook_service.deliver_due()
+
+
+async def _collect_storage():
+    from app.services.storage_gc import StorageCollector
+
+    await StorageCollector().collect()
+
+
+dispatcher = Dispatcher(
+    _process_requests,
+    sweep_interval=float(os.getenv("DISPATCH_SWEEP_INTERVAL", "15")),
+    channel="task_requests",
+)
+webhook_dispatcher = Dispatcher(
+    _deliver_webhooks,
+    sweep_interval=float(os.getenv("WEBHOOK_SWEEP_INTERVAL", "5")),
+)
+storage_gc_dispatcher = Dispatcher(
+    _collect_storage,
+    sweep_interval=float(os.getenv("STORAGE_GC_INTERVAL", "3600")),
+)
@@ -0,0 +1,110 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from loguru import logger
+from PIL import Image
+
+
+def convert_image(body: bytes) -> tuple[bytes, float]:
+    """Convert image to RGB PNG. Return converted body and time spent in seconds"""
+    started_at = time.perf_counter()
+    converted = BytesIO()
+    image = Image.open(BytesIO(body))
+    image = image.convert("RGB")
+    image.save(converted, format="PNG")
+    return converted.getvalue(), time.perf_counter() - started_at
+
+
+def make_thumbnail(body: bytes, size: int) -> tuple[bytes, float]:
+    """Resize image to fit into size x size PNG. Return thumbnail body and time spent in seconds"""
+    started_at = time.perf_counter()
+    thumbnail = BytesIO()
+    image = Image.open(BytesIO(body))
+    image.thumbnail((size, size))
+    image.save(thumbnail, format="PNG")
+    return thumbnail.getvalue(), time.perf_counter() - started_at
+
+
+def make_variants(
+    body: bytes, variants: list[tuple[str, int | None]], quality: int
+) -> tuple[dict[tuple[str, int | None], bytes], float]:
+    """
+    Encode image in (format, size) variants, size None is the full size.
+    Return variants bodies and time spent in seconds
+    """
+    started_at = time.perf_counter()
+    image = Image.open(BytesIO(body))
+    image.load()
+    results = {}
+    for format, size in variants:
+        variant = image
+        if size is not None:
+            variant = image.copy()
+            variant.thumbnail((size, size))
+        encoded = BytesIO()
+        params = {} if format == "png" else {"quality": quality}
+        variant.save(encoded, format=format.upper(), **params)
+        results[(format, size)] = encoded.getvalue()
+    return results, time.perf_counter() - started_at
+
+
+class ImageProcessor:
+    """Run image decode/convert/encode work in a process pool, off the event loop"""
+    pool_size = int(os.getenv("IMAGE_PROCESS_POOL_SIZE", "2"))
+
+    def __init__(self):
+        self._executor: ProcessPoolExecutor | None = None
+        self.queue_depth = 0
+        # Totals of this process, for the task statistics
+        self.processed = 0
+        self.spent_seconds = 0.0
+        self.waited_seconds = 0.0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.pool_size,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def _run(self, function, *args):
+        self.queue_depth += 1
+        queued_at = time.perf_counter()
+        try:
+            result, spent = await asyncio.get_running_loop().run_in_executor(
+                self.executor, function, *args
+            )
+        finally:
+            self.queue_depth -= 1
+        waited = time.perf_counter() - queued_at - spent
+        self.processed += 1
+        self.spent_seconds += spent
+        self.waited_seconds += waited
+        logger.debug(
+            f"{function.__name__}: {spent=:.3f}s {waited=:.3f}s queue_depth={self.queue_depth}"
+        )
+        return result
+
+    async def convert(self, body: bytes) -> bytes:
+        return await self._run(convert_image, body)
+
+    async def thumbnail(self, body: bytes, size: int) -> bytes:
+        return await self._run(make_thumbnail, body, size)
+
+    async def make_variants(
+        self, body: bytes, variants: list[tuple[str, int | None]], quality: int
+    ) -> dict[tuple[str, int | None], bytes]:
+        return await self._run(make_variants, body, variants, quality)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+image_processor = ImageProcessor()
@@ -1,11 +1,17 @@
 from uuid import UUID
 from fastapi import Depends
+import os
 
+from app.repositories.cache import converted_image_cache, prompt_cache
 from app.repositories.prompt import PromptRepository
 from app.schemas.model import ModelSearchSchema, ModelSchema
+from app.services.image_processor import image_processor
 
 
 class ModelService:
+    # Thumbnails are made only in these sizes, so clients cannot request an encode per any size
+    image_sizes = sorted(int(size) for size in os.getenv("MODEL_IMAGE_SIZES", "64,128,256,512").split(",") if size)
+
     def __init__(
             self,
             prompt_repository: PromptRepository = Depends(PromptRepository.depend)
@@ -13,12 +19,43 @@ class ModelService:
         self.prompt_repository = prompt_repository
 
     async def list(self, schema: ModelSearchSchema) -> list[ModelSchema]:
-        prompts = await self.prompt_repository.list(is_model=True, **schema.model_dump())
-        return [
-            ModelSchema.model_validate(prompt)
-            for prompt in prompts
-        ]
-
-    async def get_image(self, model_id: UUID) -> bytes:
-        return await self.prompt_repository.get_image(model_id)
+        key = ("models", schema.page, schema.count)
+        models = prompt_cache.get(key)
+        if models is None:
+            prompts = await self.prompt_repository.list(is_model=True, **schema.model_dump())
+            models = [
+                ModelSchema.model_validate(prompt)
+                for prompt in prompts
+            ]
+            prompt_cache.set(key, models)
+        return models
+
+    async def get_image_etag(self, model_id: UUID) -> str | None:
+        key = ("image_etag", model_id)
+        etag = prompt_cache.get(key)
+        if etag is None:
+            etag = await self.prompt_repository.get_image_etag(model_id)
+            prompt_cache.set(key, etag)
+        return etag
+
+    def get_image_size(self, size: int | None) -> int | None:
+        """Smallest thumbnail size not less than requested, or None for the full size"""
+        if size is None:
+            return None
+        return next((image_size for image_size in self.image_sizes if image_size >= size), None)
+
+    async def get_image(self, model_id: UUID, etag: str, size: int | None = None) -> bytes | None:
+        """Prompt image, or its thumbnail fitting into size x size. Size is one of get_image_size()"""
+        if size is None:
+            return await self.prompt_repository.get_image(model_id)
+
+        key = f"prompt-{model_id}-{etag}-{size}"
+        thumbnail = await converted_image_cache.get(key)
+        if thumbnail is None:
+            body = await self.prompt_repository.get_image(model_id)
+            if body is None:
+                return None
+            thumbnail = await image_processor.thumbnail(body, size)
+            await converted_image_cache.set(key, thumbnail)
+        return thumbnail
 
@@ -1,5 +1,6 @@
 from uuid import UUID
 from fastapi import Depends
+from app.repositories.cache import prompt_cache
 from app.repositories.prompt_category import PromptCategoryRepository
 from app.schemas.model_category import ModelCategorySchema, ModelCategorySearchSchema
 
@@ -9,12 +10,22 @@ class ModelCategoryService:
         self.category_repository = category_repository
 
     async def get_list(self, schema: ModelCategorySearchSchema) -> list[ModelCategorySchema]:
-        models = await self.category_repository.list(**schema.model_dump(exclude_none=True))
-        return [
-            ModelCategorySchema.model_validate(model)
-            for model in models
-        ]
+        key = ("categories", schema.page, schema.count)
+        categories = prompt_cache.get(key)
+        if categories is None:
+            models = await self.category_repository.list(**schema.model_dump(exclude_none=True))
+            categories = [
+                ModelCategorySchema.model_validate(model)
+                for model in models
+            ]
+            prompt_cache.set(key, categories)
+        return categories
 
     async def get(self, category_id: UUID) -> ModelCategorySchema:
-        model = await self.category_repository.get(category_id)
-        return ModelCategorySchema.model_validate(model)
+        key = ("category", category_id)
+        category = prompt_cache.get(key)
+        if category is None:
+            model = await self.category_repository.get(category_id)
+            category = ModelCategorySchema.model_validate(model)
+            prompt_cache.set(key, category)
+        return category
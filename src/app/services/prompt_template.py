@@ -0,0 +1,51 @@
+import re
+
+
+class PromptTemplate:
+    """
+    Prompt text with {key} placeholders for the declared user input keys, parsed once.
+    When user inputs are substituted, double braces are literal braces, as with str.format before,
+    and other braces are kept as is. Without user inputs the text is used verbatim.
+    """
+
+    def __init__(self, text: str, keys: list[str]):
+        self.text = text
+        self.keys = set(keys)
+        # Tokens are literal text, escaped braces, or placeholders of the declared keys
+        alternatives = [r"\{\{", r"\}\}"]
+        if self.keys:
+            pattern = "|".join(re.escape(key) for key in sorted(self.keys, key=len, reverse=True))
+            alternatives.append(r"\{(?:" + pattern + r")\}")
+        self._tokens = [token for token in re.split("(" + "|".join(alternatives) + ")", text) if token]
+        self.placeholders = {
+            token[1:-1] for token in self._tokens
+            if token not in ("{{", "}}") and token[:1] == "{" and token[1:-1] in self.keys
+        }
+        # {name} without a declared key, rendered as text
+        self.undeclared = {
+            match.group(1) for token in self._tokens if token[1:-1] not in self.keys
+            for match in re.finditer(r"\{(\w+)\}", token)
+        }
+
+    def validate(self, values: dict[str, str]):
+        """Raise ValueError if values miss placeholders or have unknown keys"""
+        errors = []
+        if missing := self.placeholders - values.keys():
+            errors.append(f"Missing user inputs: {', '.join(sorted(missing))}")
+        if unknown := values.keys() - self.keys:
+            errors.append(f"Unknown user inputs: {', '.join(sorted(unknown))}")
+        if errors:
+            raise ValueError("; ".join(errors))
+
+    def render(self, values: dict[str, str]) -> str:
+        if not values:
+            return self.text
+        rendered = []
+        for token in self._tokens:
+            if token in ("{{", "}}"):
+                rendered.append(token[0])
+            elif token[:1] == "{" and token[1:-1] in self.keys:
+                rendered.append(values[token[1:-1]])
+            else:
+                rendered.append(token)
+        return "".join(rendered)
@@ -0,0 +1,89 @@
+import asyncio
+import os
+from uuid import UUID
+from loguru import logger
+from PIL import features
+
+from app.repositories.storage import get_storage_repository
+from app.services.image_processor import image_processor
+
+media_types = {"png": "image/png", "webp": "image/webp", "avif": "image/avif"}
+
+
+class ResultVariants:
+    """
+    Smaller encodings and thumbnails of task results.
+    They are made in the image process pool after the task is finished,
+    until then the original PNG is served.
+    """
+    # avif needs a Pillow build with an AVIF encoder, formats not supported by Pillow are skipped
+    formats = [
+        format
+        for format in os.getenv("RESULT_FORMATS", "webp").split(",")
+        if format and features.check(format)
+    ]
+    sizes = sorted(int(size) for size in os.getenv("RESULT_THUMBNAIL_SIZES", "256,512").split(",") if size)
+    quality = int(os.getenv("RESULT_QUALITY", "80"))
+
+    def __init__(self):
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def variants(self) -> list[tuple[str, int | None]]:
+        return (
+            [(format, None) for format in self.formats]
+            + [(format, size) for format in ["png", *self.formats] for size in self.sizes]
+        )
+
+    @staticmethod
+    def get_filename(task_id: UUID, format: str = "png", size: int | None = None) -> str:
+        filename = str(task_id) + "-result"
+        if format == "png" and size is None:
+            return filename
+        return f"{filename}-{size or 'full'}.{format}"
+
+    def get_size(self, size: int | None) -> int | None:
+        """Smallest thumbnail size not less than requested, or None for the full size"""
+        if size is None:
+            return None
+        return next((thumbnail_size for thumbnail_size in self.sizes if thumbnail_size >= size), None)
+
+    def negotiate_format(self, accept: str | None) -> str:
+        """Best format acceptable by the client"""
+        accept = accept or ""
+        for format in ("avif", "webp"):
+            if format in self.formats and media_types[format] in accept:
+                return format
+        return "png"
+
+    async def _make(self, task_id: UUID):
+        storage_repository = get_storage_repository()
+        body = await storage_repository.get_file(self.get_filename(task_id))
+        if body is None:
+            return
+        results = await image_processor.make_variants(body, self.variants, self.quality)
+        del body
+        await asyncio.gather(*[
+            storage_repository.store_file(self.get_filename(task_id, format, size), variant)
+            for (format, size), variant in results.items()
+        ])
+
+    async def _run(self, task_id: UUID):
+        try:
+            await self._make(task_id)
+        except Exception as e:
+            logger.exception(e)
+
+    def schedule(self, task_id: UUID):
+        """Make variants in background, so the task is finished without waiting for them"""
+        task = asyncio.create_task(self._run(task_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def stop(self):
+        """Wait for variants being made"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+result_variants = ResultVariants()
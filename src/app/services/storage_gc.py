@@ -0,0 +1,171 @@
+import asyncio
+import os
+import re
+import time
+from collections import defaultdict
+from uuid import UUID
+from loguru import logger
+
+from app.repositories.context_entity import ContextEntityRepository
+from app.repositories.storage import get_storage_repository
+from app.repositories.task import TaskRepository
+from app.repositories.task_request import TaskRequestRepository
+from app.services.result_variants import result_variants
+
+day = 24 * 60 * 60
+hour = 60 * 60
+
+
+class StorageCollector:
+    """
+    Storage garbage collection. A file is deleted when:
+    - it is a context image, older than the context images retention (0 keeps them while used)
+    - else it is a request upload, which was dispatched, older than the requests retention
+    - else it is a result, which no task item links to, or older than the results retention (0 keeps it while linked)
+    Sidecars and variants follow their file. Then storage internal data not used anymore is deleted.
+
+    If the storage is still over STORAGE_MAX_SIZE_GB, kept dispatched request uploads and results
+    are deleted oldest first. Their sizes are counted by age in hours during the pass,
+    and a second pass deletes the ones older than the age, which frees enough.
+    Context images in use and uploads of pending requests are never deleted by size.
+
+    Work is done in batches with pauses, to keep storage I/O for serving.
+    """
+    request_retention = float(os.getenv("STORAGE_REQUEST_RETENTION_DAYS", "7")) * day
+    result_retention = float(os.getenv("STORAGE_RESULT_RETENTION_DAYS", "0")) * day
+    context_image_retention = float(os.getenv("STORAGE_CONTEXT_IMAGE_RETENTION_DAYS", "0")) * day
+    max_size = float(os.getenv("STORAGE_MAX_SIZE_GB", "0")) * 1024 ** 3  # 0 is no limit
+    grace = float(os.getenv("STORAGE_GC_GRACE_SECONDS", "3600"))
+    batch_size = int(os.getenv("STORAGE_GC_BATCH_SIZE", "500"))
+    pause = float(os.getenv("STORAGE_GC_PAUSE", "0.5"))
+
+    filename_pattern = re.compile(r"^(?P<task_id>[0-9a-f-]{36})-(?P<kind>request|result)")
+
+    def __init__(self):
+        self.storage_repository = get_storage_repository()
+
+    def _parse(self, names: list[tuple[str, float, float]]) -> list[tuple[str, str, UUID, str, float, float]]:
+        """(filename, base filename, task id, kind, age, size) of files older than grace period"""
+        now = time.time()
+        files = []
+        for name, written_at, size in names:
+            match = self.filename_pattern.match(name)
+            if match is None or now - written_at < self.grace:
+                continue
+            try:
+                task_id = UUID(match.group("task_id"))
+            except ValueError:
+                continue
+            files.append((name, match.group(0), task_id, match.group("kind"), now - written_at, size))
+        return files
+
+    async def _links_result(self, task_id: UUID, result_url: str) -> bool:
+        """Whether the URL is of the stored result: by the API or the permanent storage URL"""
+        if result_url.endswith(f"/api/task/{task_id}/result"):
+            return True
+        return result_url == await self.storage_repository.get_public_url(result_variants.get_filename(task_id))
+
+    async def _classify(
+        self, names: list[tuple[str, float, float]]
+    ) -> tuple[list[str], list[tuple[str, float, float]]]:
+        """Filenames of garbage, and (filename, age, size) of kept files, which the size limit may delete"""
+        files = self._parse(names)
+        if not files:
+            return [], []
+
+        base_filenames = list({file[1] for file in files})
+        task_ids = list({file[2] for file in files})
+        async with ContextEntityRepository() as entity_repository:
+            task_repository = TaskRepository(session=entity_repository.session)
+            request_repository = TaskRequestRepository(session=entity_repository.session)
+            context_images = await entity_repository.list_image_references(base_filenames)
+            linked_results = {
+                task_id
+                for task_id, result_url in await task_repository.list_result_urls(task_ids)
+                if result_url and await self._links_result(task_id, result_url)
+            }
+            pending_tasks = await request_repository.list_task_ids(task_ids)
+
+        garbage, evictable = [], []
+        for name, base_filename, task_id, kind, age, size in files:
+            if base_filename in context_images:
+                if not self.context_image_retention or age < self.context_image_retention:
+                    continue
+            elif kind == "request":
+                if task_id in pending_tasks:
+                    continue
+                if age < self.request_retention:
+                    evictable.append((name, age, size))
+                    continue
+            elif task_id in linked_results and (not self.result_retention or age < self.result_retention):
+                evictable.append((name, age, size))
+                continue
+            garbage.append(name)
+        return garbage, evictable
+
+    async def _delete(self, names: list[str]):
+        for name in names:
+            await self.storage_repository.delete_file(name)
+        await asyncio.sleep(self.pause)
+
+    async def _list_batches(self):
+        """Filenames in batches of at least batch_size"""
+        names = []
+        async for batch in self.storage_repository.list_names():
+            names += batch
+            if len(names) >= self.batch_size:
+                yield names
+                names = []
+        if names:
+            yield names
+
+    async def _collect_by_age(self) -> tuple[int, float, dict[int, float]]:
+        """Delete garbage. Return deleted count, size of kept files and sizes of evictable ones by age in hours"""
+        deleted = 0
+        kept_size = 0.0
+        evictable_sizes: dict[int, float] = defaultdict(float)
+        async for names in self._list_batches():
+            garbage, evictable = await self._classify(names)
+            await self._delete(garbage)
+            deleted += len(garbage)
+            garbage_set = set(garbage)
+            kept_size += sum(size for name, _, size in names if name not in garbage_set)
+            for _, age, size in evictable:
+                evictable_sizes[int(age // hour)] += size
+        return deleted, kept_size, evictable_sizes
+
+    async def _collect_by_size(self, excess: float, evictable_sizes: dict[int, float]) -> int:
+        """Delete the oldest evictable files, until excess bytes are freed. Return deleted count"""
+        min_age_hours, covered = 0, 0.0
+        for age_hours in sorted(evictable_sizes, reverse=True):
+            covered += evictable_sizes[age_hours]
+            min_age_hours = age_hours
+            if covered >= excess:
+                break
+
+        deleted = 0
+        freed = 0.0
+        async for names in self._list_batches():
+            _, evictable = await self._classify(names)
+            oldest = [(name, size) for name, age, size in evictable if age >= min_age_hours * hour]
+            if not oldest:
+                continue
+            await self._delete([name for name, _ in oldest])
+            deleted += len(oldest)
+            freed += sum(size for _, size in oldest)
+            if freed >= excess:
+                break
+        return deleted
+
+    async def collect(self):
+        started_at = time.perf_counter()
+        deleted_names, kept_size, evictable_sizes = await self._collect_by_age()
+        deleted_by_size = 0
+        if self.max_size and kept_size > self.max_size:
+            deleted_by_size = await self._collect_by_size(kept_size - self.max_size, evictable_sizes)
+
+        deleted_unused = await self.storage_repository.delete_unused(self.grace, self.batch_size, self.pause)
+        logger.info(
+            f"Storage collected in {time.perf_counter() - started_at:.1f}s: "
+            f"{deleted_names=} {deleted_by_size=} {deleted_unused=} {kept_size=:.0f}"
+        )
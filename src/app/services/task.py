@@ -1,19 +1,26 @@
+from collections import deque
+from contextlib import suppress
 from io import BytesIO
+import datetime as dt
 import json
-from aiohttp import ClientSession
 import asyncio
-from typing import Any, Coroutine
-from PIL import Image
+from functools import partial
+from typing import Any, Callable, Coroutine
 from loguru import logger
+from pathlib import Path
 from uuid import UUID
 from fastapi import Depends, HTTPException
+from openai import RateLimitError
 import base64
 import os
+import socket
+import time
 
 from pydantic import BaseModel
 
-from app.db.tables import ContextEntityRole, TaskItem
-from app.repositories.openai import OpenAIRepository
+from app.db.tables import ContextEntityRole, TaskItem, TaskRequestLane
+from app.repositories.cache import converted_image_cache, data_url_cache, prompt_cache
+from app.repositories.openai import ImageWriter, OpenAIRepository
 from app.repositories.prompt import PromptRepository
 from app.repositories.task import TaskRepository
 from app.repositories.task_request import TaskRequestRepository
@@ -23,25 +30,38 @@ from app.schemas.external import (
     ExternalText2ImageTaskSchema,
     ExternalText2TextTaskSchema,
 )
-from app.repositories.storage import StorageRepository
+from app.repositories.storage import StorageRepository, get_storage_repository
 from app.schemas.task import (
+    TaskBatchSchema,
     TaskImageCreateSchema,
+    TaskLaneSchema,
     TaskSchema,
     TaskShortSchema,
     TaskStatisticsSchema,
     TaskTextCreateSchema,
 )
+from app.services.concurrency import concurrency_controller, parse_reset_in
 from app.services.context import ContextService
-
-
-remaining_requests: int | None = None
-remaining_tokens: int | None = None
-remaining_reset_in: str | None = None
+from app.services.dispatcher import dispatcher
+from app.services.image_processor import image_processor
+from app.services.prompt_template import PromptTemplate
+from app.services.result_variants import media_types, result_variants
+from app.services.task_events import task_events
+from app.services.webhook import WebhookService
 
 
 class TaskService:
     external_url = os.getenv("EXTERNAL_URL")
-    sended_tasks: list[UUID] = []
+    data_url_suffix = ".dataurl"
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    lease_seconds = float(os.getenv("DISPATCH_LEASE_SECONDS", "900"))
+    # The event loop keeps only weak references to tasks
+    _processing: set[asyncio.Task] = set()
+    lanes_concurrency = {
+        TaskRequestLane.text2text.value: int(os.getenv("LANE_TEXT2TEXT_CONCURRENCY", "8")),
+        TaskRequestLane.text2image.value: int(os.getenv("LANE_TEXT2IMAGE_CONCURRENCY", "4")),
+        TaskRequestLane.image2image.value: int(os.getenv("LANE_IMAGE2IMAGE_CONCURRENCY", "4")),
+    }
 
     def __init__(
         self,
@@ -51,24 +71,40 @@ class TaskService:
             TaskRequestRepository.depend
         ),
         openai_repository: OpenAIRepository = Depends(),
-        storage_repository: StorageRepository = Depends(),
+        storage_repository: StorageRepository = Depends(get_storage_repository),
     ):
-        global remaining_requests, remaining_tokens, remaining_reset_in
-        self.remaining_requests = remaining_requests
-        self.remaining_tokens = remaining_tokens
-        self.remaining_reset_in = remaining_reset_in
-
         self.task_repository = task_repository
         self.external_repository = openai_repository
         self.prompt_repository = prompt_repository
         self.request_repository = request_repository
         self.storage_repository = storage_repository
+        self.request_id: int | None = None  # Leased request, which is processed
+        self.request_finished = True
+
+    async def _finish_request(self) -> bool:
+        """
+        Delete the processed request, if this worker still holds its lease.
+        It is committed with the result written next, which is skipped if False is returned,
+        as the request was taken by another worker.
+        """
+        if self.request_id is not None:
+            self.request_finished = await self.request_repository.finish(self.request_id, self.worker_id)
+            if not self.request_finished:
+                logger.warning(f"Lease of request {self.request_id} is lost, dropping the result")
+            self.request_id = None
+        return self.request_finished
 
     async def create(self, schema: TaskImageCreateSchema | TaskTextCreateSchema) -> TaskShortSchema:
         if isinstance(schema, TaskImageCreateSchema) and schema.user_prompt is None and schema.model_id is None:
             raise HTTPException(
                 422, detail="Model id and prompt cannot be None at one time"
             )
+        if isinstance(schema, TaskImageCreateSchema) and schema.model_id is not None:
+            template = await self._get_prompt_template(schema.model_id)
+            try:
+                template.validate(self._get_user_inputs(schema))
+            except ValueError as e:
+                raise HTTPException(422, detail=str(e))
 
         if schema.context_id == "last":
             async with ContextService() as context_service:
@@ -81,16 +117,76 @@ class TaskService:
         )
         return TaskShortSchema.model_validate(model)
 
-    def _convert_image(self, image_buffer: BytesIO) -> BytesIO:
-        converted = BytesIO()
-        image = Image.open(image_buffer)
-        image = image.convert("RGB")
-        # [image.putpixel((x, y), image.getpixel((x, y))[:3] + (0,)) for x in range(image.size[0]) for y in range(image.size[1])]
-        # logger.debug(image.getpixel((0, 0)))
-        image.save(converted, format="PNG", mode="RGB")
-        converted.seek(0)
+    @staticmethod
+    def _encode_data_url(body: bytes) -> str:
+        return "data:image/png;base64," + base64.b64encode(body).decode()
+
+    async def _store_image(self, filename: str, body: bytes):
+        """Store image with a sidecar file of its data URL for text requests"""
+        data_url = self._encode_data_url(body)
+        await asyncio.gather(
+            self.storage_repository.store_file(filename, body),
+            self.storage_repository.store_file(filename + self.data_url_suffix, data_url.encode()),
+        )
+        data_url_cache.set(filename, data_url)
+
+    async def _get_image_data_url(self, filename: str) -> str | None:
+        data_url = data_url_cache.get(filename)
+        if data_url is not None:
+            return data_url
+
+        sidecar = await self.storage_repository.get_file(filename + self.data_url_suffix)
+        if sidecar is not None:
+            data_url = sidecar.decode()
+        else:  # Stored before sidecar files were written
+            body = await self.storage_repository.get_file(filename)
+            if not body:
+                return None
+            data_url = self._encode_data_url(body)
+            await self.storage_repository.store_file(filename + self.data_url_suffix, data_url.encode())
+        data_url_cache.set(filename, data_url)
+        return data_url
+
+    async def _convert_image(self, filename: str, body: bytes | None = None) -> bytes | None:
+        """Get converted stored image from cache or convert and cache it"""
+        converted = await converted_image_cache.get(filename)
+        if converted is not None:
+            return converted
+        if body is None:
+            body = await self.storage_repository.get_file(filename)
+        if body is None:
+            return None
+        converted = await image_processor.convert(body)
+        await converted_image_cache.set(filename, converted)
         return converted
 
+    async def _get_context_images(self, schema: TaskImageCreateSchema) -> list[BytesIO]:
+        if schema.context is None:
+            return []
+        converted = await asyncio.gather(*[
+            self._convert_image(filename)
+            for filename in schema.context.images_filenames
+        ])
+        return [BytesIO(body) for body in converted if body is not None]
+
+    async def _get_prompt_template(self, model_id: str) -> PromptTemplate:
+        key = ("template", str(model_id))
+        template = prompt_cache.get(key)
+        if template is None:
+            model = await self.prompt_repository.get(model_id)
+            template = PromptTemplate(model.text, [i.key for i in model.user_inputs])
+            if template.undeclared:
+                logger.warning(
+                    f"Prompt {model_id} has placeholders without user inputs, kept as text: "
+                    f"{', '.join(sorted(template.undeclared))}"
+                )
+            prompt_cache.set(key, template)
+        return template
+
+    @staticmethod
+    def _get_user_inputs(schema: TaskImageCreateSchema) -> dict[str, str]:
+        return {user_input.key: user_input.value for user_input in schema.user_inputs or []}
+
     async def build_prompt(
         self, schema: TaskImageCreateSchema | TaskTextCreateSchema, include_context: bool = True
     ) -> str:
@@ -106,14 +202,8 @@ class TaskService:
                 prompt += f"{entity.role.value}: {entity.content}\n"
 
         if schema.model_id is not None:
-            model = await self.prompt_repository.get(schema.model_id)
-            prompt += model.text
-
-            if schema.user_inputs and model.user_inputs:
-                prompt_user_inputs_keys = [i.key for i in model.user_inputs]
-                for user_input in schema.user_inputs:
-                    if user_input.key in prompt_user_inputs_keys:
-                        prompt = prompt.format(**{user_input.key: user_input.value})
+            template = await self._get_prompt_template(schema.model_id)
+            prompt += template.render(self._get_user_inputs(schema))
 
         elif schema.user_prompt:
             prompt += schema.user_prompt
@@ -122,37 +212,52 @@ class TaskService:
 
     async def _send(
         self, task_id: UUID, method: Coroutine[Any, Any, ExternalResponse]
-    ) -> str | None:
+    ) -> ExternalResponse | None:
         try:
             result = await method
         except Exception as e:
             logger.exception(e)
-            await self.task_repository.update(task_id, error=str(e))
+            if isinstance(e, RateLimitError):
+                concurrency_controller.back_off(
+                    parse_reset_in(e.response.headers.get("x-ratelimit-reset-requests"))
+                )
+            if await self._finish_request():
+                await self.task_repository.update(task_id, error=str(e))
             return None
 
-        self.remaining_tokens = result.remaining_tokens
-        self.remaining_requests = result.remaining_requests
-        self.remaining_reset_in = result.reset_in
+        concurrency_controller.update(result)
 
-        if result.content is None:
-            await self.task_repository.update(task_id, error="Generation error")
+        if result.content is None and result.image_size is None:
+            if await self._finish_request():
+                await self.task_repository.update(task_id, error="Generation error")
             return None
-        return result.content
+        return result
 
     async def _send_for_image(
         self,
         task_id: UUID,
         context_id: UUID | None,
-        method: Coroutine[Any, Any, ExternalResponse],
+        generate: Callable[[ImageWriter], Coroutine[Any, Any, ExternalResponse]],
     ):
-        content = await self._send(task_id, method)
-        if content is None:
+        """
+        Generate image, which is decoded and written to the storage while it is received.
+        Its data URL sidecar is made on the first use in a text request.
+        """
+        filename = result_variants.get_filename(task_id)
+        result = await self._send(
+            task_id,
+            generate(lambda chunks: self.storage_repository.store_stream(filename, chunks)),
+        )
+        if result is None or not await self._finish_request():
             return
 
-        filename = str(task_id) + "-result"
-        if not content.startswith("http"):
-            self.storage_repository.store_file(filename, base64.b64decode(content))
-            content = self.external_url + f"/api/task/{task_id}/result"
+        content = result.content
+        if result.image_size is not None:
+            content = (
+                await self.storage_repository.get_public_url(filename)
+                or self.external_url + f"/api/task/{task_id}/result"
+            )
+            result_variants.schedule(task_id)
 
         await self.task_repository.create_items(
             TaskItem(task_id=task_id, result_url=content)
@@ -171,9 +276,10 @@ class TaskService:
         context_id: UUID | None,
         method: Coroutine[Any, Any, ExternalResponse],
     ):
-        content = await self._send(task_id, method)
-        if content is None:
+        result = await self._send(task_id, method)
+        if result is None or not await self._finish_request():
             return
+        content = result.content
 
         await self.task_repository.create_items(
             TaskItem(task_id=task_id, result_url=content)
@@ -200,16 +306,15 @@ class TaskService:
                 )
                 continue
 
-            image_body = self.storage_repository.get_file(context_entity.content)
-            if not image_body:
+            image_url = await self._get_image_data_url(context_entity.content)
+            if not image_url:
                 continue
             request_input.append(
                 ExternalText2TextTaskSchema.ImageMessage(
                     role=context_entity.role.value,
                     content=[
                         ExternalText2TextTaskSchema.ImageMessage.ImageContent(
-                            image_url="data:image/png;base64,"
-                            + base64.b64encode(image_body).decode()
+                            image_url=image_url
                         )
                     ],
                 )
@@ -221,8 +326,10 @@ class TaskService:
                     role=ContextEntityRole.user.value,
                     content=[
                         ExternalText2TextTaskSchema.ImageMessage.ImageContent(
-                            image_url="data:image/png;base64,"
-                            + base64.b64encode(image.getvalue()).decode()
+                            image_url=(
+                                await self._get_image_data_url(str(task_id) + "-request")
+                                or self._encode_data_url(image.getvalue())
+                            )
                         )
                     ],
                 )
@@ -247,16 +354,7 @@ class TaskService:
         request = ExternalText2ImageTaskSchema(
             prompt=prompt, size=schema.size, quality=schema.quality
         )
-        images = []
-
-        if schema.context is not None:
-            for context_image_filename in schema.context.images_filenames:
-                if not self.storage_repository.exists(context_image_filename):
-                    continue
-                context_image = BytesIO(
-                    self.storage_repository.get_file(context_image_filename)
-                )
-                images.append(self._convert_image(context_image))
+        images = await self._get_context_images(schema)
 
         if images:
             request = ExternalImage2ImageTaskSchema(
@@ -265,28 +363,23 @@ class TaskService:
             return await self._send_for_image(
                 task_id,
                 schema.context_id,
-                self.external_repository.generate_image2image(request),
+                partial(self.external_repository.generate_image2image, request),
             )
         return await self._send_for_image(
             task_id,
             schema.context_id,
-            self.external_repository.generate_text2image(request),
+            partial(self.external_repository.generate_text2image, request),
         )
 
     async def _send_img2img(
         self, task_id: UUID, schema: TaskImageCreateSchema, image: BytesIO
     ):
         prompt = await self.build_prompt(schema)
-        images = [self._convert_image(image)]
-
-        if schema.context is not None:
-            for context_image_filename in schema.context.images_filenames:
-                if not self.storage_repository.exists(context_image_filename):
-                    continue
-                context_image = BytesIO(
-                    self.storage_repository.get_file(context_image_filename)
-                )
-                images.append(self._convert_image(context_image))
+        converted, context_images = await asyncio.gather(
+            self._convert_image(str(task_id) + "-request", image.getvalue()),
+            self._get_context_images(schema),
+        )
+        images = [BytesIO(converted)] + context_images
 
         request = ExternalImage2ImageTaskSchema(
             prompt=prompt, size=schema.size, images=images, quality=schema.quality
@@ -294,23 +387,60 @@ class TaskService:
         return await self._send_for_image(
             task_id,
             schema.context_id,
-            self.external_repository.generate_image2image(request),
+            partial(self.external_repository.generate_image2image, request),
         )
 
     async def get(self, task_id: UUID) -> TaskSchema:
         model = await self.task_repository.get(task_id)
         return TaskSchema.model_validate(model)
 
+    async def get_many(self, schema: TaskBatchSchema) -> list[TaskSchema]:
+        changed_since = schema.changed_since
+        if changed_since is not None and changed_since.tzinfo is not None:
+            changed_since = changed_since.astimezone(dt.timezone.utc).replace(tzinfo=None)
+        models = await self.task_repository.list_by_ids(schema.ids, changed_since)
+        return [TaskSchema.model_validate(model) for model in models]
+
+    @staticmethod
+    def _is_finished(task: TaskSchema) -> bool:
+        return task.error is not None or bool(task.items)
+
+    async def wait(self, task_id: UUID, timeout: float) -> TaskSchema:
+        """Get task, waiting up to timeout seconds for it to finish"""
+        with task_events.subscribe(task_id) as finished:
+            task = await self.get(task_id)
+            if self._is_finished(task) or timeout <= 0:
+                return task
+            await self.task_repository.release()
+            with suppress(TimeoutError):
+                await asyncio.wait_for(finished, timeout)
+        return await self.get(task_id)
+
+    @classmethod
+    async def stream_events(cls, task_id: UUID, heartbeat: float, max_duration: float):
+        """Server-Sent Events stream, which ends with 'finished' event with the task"""
+        deadline = time.monotonic() + max_duration
+        while True:
+            with task_events.subscribe(task_id) as finished:
+                async with cls() as self:
+                    task = await self.get(task_id)
+                if self._is_finished(task):
+                    yield f"event: finished\ndata: {task.model_dump_json()}\n\n"
+                    return
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    yield "event: timeout\ndata: {}\n\n"
+                    return
+                try:
+                    await asyncio.wait_for(finished, min(heartbeat, remaining))
+                except TimeoutError:
+                    yield ": ping\n\n"
+
     async def send_webhook(self, task_id: UUID, webhook_url: str):
-        task = await self.get(task_id)
-        async with ClientSession() as session:
-            try:
-                resp = await session.post(webhook_url, data=task.model_dump_json())
-            except Exception as e:
-                logger.warning(f"Error on webhook send: {e}")
-                return
-            if resp.status != 200:
-                logger.warning(f"Error on webhook send: {await resp.text()}")
+        """Queue webhook delivery, it is sent outside of the generation path"""
+        async with WebhookService() as webhook_service:
+            await webhook_service.add(task_id, webhook_url)
 
     @classmethod
     async def _process_request(
@@ -322,11 +452,10 @@ class TaskService:
     ):
         async with cls() as self:
             logger.info(f"Sending {task_id=}")
-            await self.request_repository.update(request_id, status="sended")
-            await self.request_repository._commit()
-
             create_schema = json.loads(schema)
+            self.request_id = request_id
 
+            renewal = asyncio.create_task(cls._renew_lease(request_id))
             try:
                 if create_schema.get("task_type") == "image":
                     create_schema = TaskImageCreateSchema.model_validate(create_schema)
@@ -337,19 +466,53 @@ class TaskService:
                 elif create_schema.get("task_type") == "text":
                     create_schema = TaskTextCreateSchema.model_validate(create_schema)
                     await self._send_2txt(task_id, create_schema, image)
-                else:
+                elif await self._finish_request():
                     await self.task_repository.update(task_id, error="Unknown task type")
             except Exception as e:
-                await self.task_repository.update(task_id, error=str(e))
+                if await self._finish_request():
+                    await self.task_repository.update(task_id, error=str(e))
+            finally:
+                renewal.cancel()
 
-            await self.request_repository.delete(request_id)
+            # Another worker took the request, so it sends the result and the webhook
+            if not await self._finish_request():
+                return
+            await self.task_repository.touch(task_id)
             await self.task_repository._commit()
+            await self.request_repository.notify(task_events.channel, str(task_id))
             if isinstance(create_schema, BaseModel) and create_schema.webhook_url is not None:
                 await self.send_webhook(task_id, create_schema.webhook_url)
             elif isinstance(create_schema, dict) and create_schema.get("webhook_url"):
                 await self.send_webhook(task_id, create_schema.get("webhook_url"))
 
         logger.info(f"Finished {task_id=}")
+        task_events.publish(str(task_id))
+        dispatcher.notify()
+
+    @classmethod
+    async def _renew_lease(cls, request_id: int):
+        """Extend the lease while the request is processed, so it is not claimed by another worker"""
+        while True:
+            await asyncio.sleep(cls.lease_seconds / 3)
+            try:
+                async with TaskRequestRepository() as request_repository:
+                    renewed = await request_repository.renew(request_id, cls.worker_id, cls.lease_seconds)
+            except Exception as e:
+                logger.exception(e)
+                continue
+            if not renewed:
+                logger.warning(f"Lease of request {request_id} is lost")
+                return
+
+    @staticmethod
+    def _get_lane(
+        schema: TaskImageCreateSchema | TaskTextCreateSchema, image: BytesIO | None
+    ) -> TaskRequestLane:
+        if isinstance(schema, TaskTextCreateSchema):
+            return TaskRequestLane.text2text
+        if image is not None or (schema.context is not None and schema.context.images_filenames):
+            return TaskRequestLane.image2image
+        return TaskRequestLane.text2image
 
     async def add_request(
         self,
@@ -368,7 +531,21 @@ class TaskService:
                     schema.context_id = (
                         await context_service.get_last(schema.user_id)
                     ).id
-                schema.context = await context_service.build_context(schema.context_id)
+                if isinstance(schema, TaskTextCreateSchema):
+                    # Text longer than 4 characters per token cannot fit in the budget
+                    context = await context_service.build_context(
+                        schema.context_id,
+                        max_text_length=context_service.get_budget(schema.app_bundle).max_tokens * 4,
+                    )
+                    schema.context = context_service.fit_to_budget(
+                        context,
+                        schema.app_bundle,
+                        reserved_tokens=context_service.estimate_tokens(prompt)
+                        + (context_service.image_tokens if image is not None else 0),
+                        reserved_images=int(image is not None),
+                    )
+                else:
+                    schema.context = await context_service.build_context(schema.context_id)
 
                 await context_service.add_entity_text(
                     schema.context_id, prompt, ContextEntityRole.user
@@ -380,34 +557,74 @@ class TaskService:
                         ContextEntityRole.user,
                     )
 
+        if image is not None:
+            await self._store_image(str(task_id) + "-request", image.getvalue())
         await self.request_repository.create(
-            task_id=task_id, schema=schema.model_dump_json()
+            task_id=task_id,
+            schema=schema.model_dump_json(),
+            lane=self._get_lane(schema, image).value,
         )
-        if image is not None:
-            self.storage_repository.store_file(
-                str(task_id) + "-request", image.getvalue()
+        await self.request_repository.notify(dispatcher.channel)
+        dispatcher.notify()
+
+    async def get_lanes_statistics(self) -> list[TaskLaneSchema]:
+        lanes = {
+            name: TaskLaneSchema(name=name, concurrency=concurrency)
+            for name, concurrency in self.lanes_concurrency.items()
+        }
+        now = dt.datetime.now()
+        for name, state, count, oldest in await self.request_repository.count_by_lane():
+            if name not in lanes:
+                continue
+            if state == "queued":
+                lanes[name].queued = count
+                lanes[name].wait_seconds = max((now - oldest).total_seconds(), 0)
+            else:
+                lanes[name].in_flight = count
+        return list(lanes.values())
+
+    async def _claim_requests(self):
+        """
+        Claim pending requests within the global window and per-lane budgets.
+        Slots are handed out round-robin, starting from the longest waiting lane,
+        so a slow lane cannot starve a fast one.
+        """
+        lanes = await self.get_lanes_statistics()
+        available = concurrency_controller.available(sum(lane.in_flight for lane in lanes))
+        if available <= 0:
+            return []
+
+        budgets = {}
+        for lane in sorted(lanes, key=lambda lane: lane.wait_seconds, reverse=True):
+            budget = min(lane.concurrency - lane.in_flight, lane.queued)
+            if budget > 0:
+                budgets[lane.name] = budget
+
+        counts = dict.fromkeys(budgets, 0)
+        order = deque(budgets)
+        while order and available > 0:
+            name = order.popleft()
+            counts[name] += 1
+            available -= 1
+            if counts[name] < budgets[name]:
+                order.append(name)
+
+        requests = []
+        for name, count in counts.items():
+            requests += await self.request_repository.claim(
+                self.worker_id, self.lease_seconds, lane=name, count=count
             )
+        return requests
 
     async def process_requests(self):
-        sended_count = await self.request_repository.count(status="sended")
-        if sended_count > 3:
-            return
-        requests = await self.request_repository.list(
-            not_sended=True, count=3 - sended_count
-        )
-        tasks = []
+        requests = await self._claim_requests()
         for request in requests:
-            if request.task_id in self.sended_tasks:
-                continue
-            self.sended_tasks.append(request.task_id)
             image = None
+            image_body = await self.storage_repository.get_file(str(request.task_id) + "-request")
+            if image_body is not None:
+                image = BytesIO(image_body)
 
-            if self.storage_repository.exists(str(request.task_id) + "-request"):
-                image = BytesIO(
-                    self.storage_repository.get_file(str(request.task_id) + "-request")
-                )
-
-            asyncio.create_task(
+            task = asyncio.create_task(
                 self._process_request(
                     request.id,
                     request.task_id,
@@ -415,25 +632,54 @@ class TaskService:
                     image=image,
                 )
             )
+            self._processing.add(task)
+            task.add_done_callback(self._on_processed)
 
-    def get_result(self, task_id: UUID) -> bytes:
-        body = self.storage_repository.get_file(str(task_id) + "-result")
-        if body is None:
-            raise HTTPException(404)
-        return body
+    @classmethod
+    def _on_processed(cls, task: asyncio.Task):
+        cls._processing.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.opt(exception=task.exception()).error("Error on process request")
+
+    async def get_result(
+        self, task_id: UUID, format: str = "png", size: int | None = None
+    ) -> tuple[Path | str, os.stat_result | None, str, bool]:
+        """
+        Result file in the format and the nearest thumbnail size,
+        or the original PNG if the variant is not made yet.
+        Return path, stat, media type and whether it is the requested variant,
+        or direct URL instead of path and None instead of stat if the storage serves files itself
+        """
+        size = result_variants.get_size(size)
+        for variant_format, variant_size in dict.fromkeys(((format, size), ("png", None))):
+            filename = result_variants.get_filename(task_id, variant_format, variant_size)
+            exact = (variant_format, variant_size) == (format, size)
+            if self.storage_repository.direct_urls:
+                if await self.storage_repository.exists(filename):
+                    return await self.storage_repository.get_url(filename), None, media_types[variant_format], exact
+                continue
+            location = await self.storage_repository.locate(filename)
+            if location is not None:
+                return *location, media_types[variant_format], exact
+        raise HTTPException(404)
 
     def get_statistics(self) -> TaskStatisticsSchema:
         if (
-            self.remaining_requests is None
-            or self.remaining_tokens is None
+            concurrency_controller.remaining_requests is None
+            or concurrency_controller.remaining_tokens is None
         ):
             raise HTTPException(
                 500,
                 detail="Remaining info is not stored. Please, wait for at least one request processed",
             )
         return TaskStatisticsSchema(
-            remaining_requests=self.remaining_requests,
-            remaining_tokens=self.remaining_tokens,
+            remaining_requests=concurrency_controller.remaining_requests,
+            remaining_tokens=concurrency_controller.remaining_tokens,
+            concurrency_limit=concurrency_controller.limit,
+            image_queue_depth=image_processor.queue_depth,
+            image_processed=image_processor.processed,
+            image_average_seconds=image_processor.spent_seconds / max(image_processor.processed, 1),
+            image_average_wait_seconds=image_processor.waited_seconds / max(image_processor.processed, 1),
         )
 
     async def __aenter__(self):
@@ -443,7 +689,7 @@ class TaskService:
             session=self.task_repository.session
         )
         self.external_repository = OpenAIRepository()
-        self.storage_repository = StorageRepository()
+        self.storage_repository = get_storage_repository()
         return self
 
     async def __aexit__(self, *exinfo):
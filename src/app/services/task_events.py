@@ -0,0 +1,45 @@
+import asyncio
+from contextlib import contextmanager
+from typing import Iterator
+from uuid import UUID
+
+from app.repositories.notification import notification_listener
+
+
+class TaskEvents:
+    """
+    In-process waiters for task completion.
+    Woken by publish() in this process and by Postgres NOTIFY on the channel from other processes.
+    """
+    channel = "task_finished"
+
+    def __init__(self):
+        self._waiters: dict[str, set[asyncio.Future]] = {}
+
+    def publish(self, task_id: str):
+        for future in self._waiters.get(str(task_id), set()):
+            if not future.done():
+                future.set_result(None)
+
+    @contextmanager
+    def subscribe(self, task_id: UUID) -> Iterator[asyncio.Future]:
+        """
+        Future resolved when the task is finished.
+        Subscribe before checking the task status, so finish is not missed in between.
+        """
+        key = str(task_id)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, set()).add(future)
+        try:
+            yield future
+        finally:
+            waiters = self._waiters.get(key, set())
+            waiters.discard(future)
+            if not waiters:
+                self._waiters.pop(key, None)
+
+    def start(self):
+        notification_listener.subscribe(self.channel, self.publish)
+
+
+task_events = TaskEvents()
@@ -0,0 +1,128 @@
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from fastapi import Depends, HTTPException
+from loguru import logger
+from uuid import UUID
+import asyncio
+import os
+import random
+import time
+
+from app.repositories.task import TaskRepository
+from app.repositories.webhook_delivery import WebhookDeliveryRepository
+from app.schemas.task import TaskSchema
+from app.services.dispatcher import webhook_dispatcher
+
+
+class WebhookService:
+    """
+    Webhooks delivery. Deliveries are stored in the database
+    and sent by the webhook dispatcher with a shared HTTP session,
+    retrying failures with exponential backoff and full jitter.
+    Delivered ones are deleted, failed ones are kept for WEBHOOK_FAILED_RETENTION_DAYS.
+    """
+    timeout = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+    max_attempts = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "6"))
+    backoff_base = float(os.getenv("WEBHOOK_BACKOFF_BASE", "2"))
+    backoff_max = float(os.getenv("WEBHOOK_BACKOFF_MAX", "600"))
+    batch_size = int(os.getenv("WEBHOOK_CONCURRENCY", "16"))
+    limit_per_host = int(os.getenv("WEBHOOK_LIMIT_PER_HOST", "4"))
+    failed_retention = float(os.getenv("WEBHOOK_FAILED_RETENTION_DAYS", "7")) * 24 * 60 * 60
+    prune_interval = float(os.getenv("WEBHOOK_PRUNE_INTERVAL", "3600"))
+
+    _session: ClientSession | None = None
+    _pruned_at: float | None = None
+
+    def __init__(
+        self,
+        delivery_repository: WebhookDeliveryRepository = Depends(WebhookDeliveryRepository.depend),
+        task_repository: TaskRepository = Depends(TaskRepository.depend),
+    ):
+        self.delivery_repository = delivery_repository
+        self.task_repository = task_repository
+
+    @classmethod
+    def get_session(cls) -> ClientSession:
+        if cls._session is None or cls._session.closed:
+            cls._session = ClientSession(
+                connector=TCPConnector(limit=cls.batch_size, limit_per_host=cls.limit_per_host),
+                timeout=ClientTimeout(total=cls.timeout),
+            )
+        return cls._session
+
+    @classmethod
+    async def close(cls):
+        if cls._session is not None:
+            await cls._session.close()
+            cls._session = None
+
+    async def add(self, task_id: UUID, url: str):
+        await self.delivery_repository.create(task_id=task_id, url=url)
+        webhook_dispatcher.notify()
+
+    def _get_backoff(self, attempts: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempts))
+
+    async def _send(self, url: str, payload: str) -> str | None:
+        """Send webhook. Return error or None on success"""
+        try:
+            async with self.get_session().post(url, data=payload) as response:
+                if 200 <= response.status < 300:
+                    return None
+                return f"{response.status}: {(await response.text())[:500]}"
+        except Exception as e:
+            return repr(e)
+
+    async def prune_failed(self):
+        """Delete failed deliveries older than the retention, at most once per prune interval"""
+        now = time.monotonic()
+        if WebhookService._pruned_at is not None and now - WebhookService._pruned_at < self.prune_interval:
+            return
+        WebhookService._pruned_at = now
+        deleted = await self.delivery_repository.delete_failed(self.failed_retention)
+        if deleted:
+            logger.info(f"Deleted {deleted} failed webhook deliveries")
+
+    async def deliver_due(self):
+        await self.prune_failed()
+        while True:
+            deliveries = await self.delivery_repository.claim_due(self.timeout * 2, self.batch_size)
+            if not deliveries:
+                return
+
+            payloads = []
+            for delivery in deliveries:
+                try:
+                    task = await self.task_repository.get(delivery.task_id)
+                except HTTPException:  # Task was deleted
+                    await self.delivery_repository.delete(delivery.id)
+                    continue
+                payloads.append((delivery, TaskSchema.model_validate(task).model_dump_json()))
+
+            errors = await asyncio.gather(*[
+                self._send(delivery.url, payload) for delivery, payload in payloads
+            ])
+
+            for (delivery, _), error in zip(payloads, errors):
+                if error is None:
+                    await self.delivery_repository.delete(delivery.id)
+                elif delivery.attempts + 1 >= self.max_attempts:
+                    logger.warning(f"Error on webhook send for task_id={delivery.task_id}: {error}")
+                    await self.delivery_repository.update(
+                        delivery.id, status="failed", attempts=delivery.attempts + 1, last_error=error
+                    )
+                else:
+                    await self.delivery_repository.retry_later(
+                        delivery.id, self._get_backoff(delivery.attempts + 1), error
+                    )
+            await self.delivery_repository._commit()
+
+            if len(deliveries) < self.batch_size:
+                return
+
+    async def __aenter__(self):
+        self.delivery_repository = await WebhookDeliveryRepository().__aenter__()
+        self.task_repository = TaskRepository(session=self.delivery_repository.session)
+        return self
+
+    async def __aexit__(self, *excinfo):
+        await self.delivery_repository.__aexit__(*excinfo)
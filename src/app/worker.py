@@ -0,0 +1,52 @@
+"""
+Dispatch worker, runs only the request dispatch loop.
+Start it with `python -m app.worker` and set DISPATCHER_ENABLED=false
+for the API processes.
+"""
+import asyncio
+import signal
+from loguru import logger
+
+from app.repositories.cache import prompt_cache
+from app.repositories.notification import notification_listener
+from app.repositories.openai import OpenAIRepository
+from app.repositories.storage import get_storage_repository
+from app.services.dispatcher import dispatcher, storage_gc_dispatcher, webhook_dispatcher
+from app.services.image_processor import image_processor
+from app.services.result_variants import result_variants
+from app.services.webhook import WebhookService
+
+
+async def run():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    logger.info("Dispatch worker started")
+    dispatcher.start()
+    webhook_dispatcher.start()
+    storage_gc_dispatcher.start()
+    prompt_cache.start()
+    storage_migration = asyncio.create_task(get_storage_repository().migrate_legacy())
+    await stop.wait()
+    storage_migration.cancel()
+    await notification_listener.stop()
+    await dispatcher.stop()
+    await webhook_dispatcher.stop()
+    await storage_gc_dispatcher.stop()
+    await result_variants.stop()
+    image_processor.shutdown()
+    await OpenAIRepository.close()
+    await WebhookService.close()
+    await get_storage_repository().close()
+    logger.info("Dispatch worker stopped")
+
+
+def main():
+    logger.disable("sqlalchemy_service")
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+In-process S3-compatible server for tests of S3StorageRepository.
+It verifies Signature V4 of requests and presigned URLs on its own,
+and keeps objects and multipart uploads in memory.
+"""
+from urllib.parse import quote
+from xml.etree import ElementTree
+import datetime as dt
+import hashlib
+import hmac
+import uuid
+
+from aiohttp import web
+
+xml_namespace = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+def _quote(value: str) -> str:
+    return quote(value, safe="-_.~")
+
+
+def _canonical_query(query: dict[str, str]) -> str:
+    return "&".join(f"{_quote(key)}={_quote(value)}" for key, value in sorted(query.items()))
+
+
+class FakeS3:
+    def __init__(self, access_key_id: str, secret_access_key: str, region: str, page_size: int = 1000):
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.region = region
+        self.page_size = page_size
+        self.buckets: set[str] = set()
+        self.objects: dict[str, tuple[bytes, dt.datetime, str | None]] = {}
+        self.uploads: dict[str, dict[int, bytes]] = {}
+        self.completed_uploads: list[int] = []  # Parts count of completed multipart uploads
+        self.aborted_uploads = 0
+        self.app = web.Application()
+        self.app.router.add_route("*", "/{path:.*}", self.handle)
+
+    def _signature(
+        self, request: web.Request, query: dict[str, str], signed_headers: list[str], payload_hash: str, date: str
+    ) -> str:
+        canonical_request = "\n".join([
+            request.method,
+            request.raw_path.split("?", 1)[0],
+            _canonical_query(query),
+            "".join(f"{name}:{request.headers[name].strip()}\n" for name in signed_headers),
+            ";".join(signed_headers),
+            payload_hash,
+        ])
+        scope = f"{date[:8]}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()
+        ])
+        key = ("AWS4" + self.secret_access_key).encode()
+        for message in (date[:8], self.region, "s3", "aws4_request"):
+            key = hmac.new(key, message.encode(), hashlib.sha256).digest()
+        return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    def _is_authorized(self, request: web.Request, body: bytes) -> bool:
+        query = dict(request.query)
+        if "X-Amz-Signature" in query:
+            signature = query.pop("X-Amz-Signature")
+            date = query["X-Amz-Date"]
+            signed_at = dt.datetime.strptime(date, "%Y%m%dT%H%M%SZ").replace(tzinfo=dt.timezone.utc)
+            if dt.datetime.now(dt.timezone.utc) > signed_at + dt.timedelta(seconds=int(query["X-Amz-Expires"])):
+                return False
+            if not query["X-Amz-Credential"].startswith(self.access_key_id + "/"):
+                return False
+            expected = self._signature(
+                request, query, query["X-Amz-SignedHeaders"].split(";"), "UNSIGNED-PAYLOAD", date
+            )
+            return hmac.compare_digest(signature, expected)
+
+        authorization = request.headers.get("authorization", "")
+        if not authorization.startswith("AWS4-HMAC-SHA256 "):
+            return False
+        fields = dict(
+            field.strip().split("=", 1) for field in authorization.removeprefix("AWS4-HMAC-SHA256 ").split(",")
+        )
+        if not fields["Credential"].startswith(self.access_key_id + "/"):
+            return False
+        payload_hash = request.headers["x-amz-content-sha256"]
+        if payload_hash != hashlib.sha256(body).hexdigest():
+            return False
+        expected = self._signature(
+            request, query, fields["SignedHeaders"].split(";"), payload_hash, request.headers["x-amz-date"]
+        )
+        return hmac.compare_digest(fields["Signature"], expected)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if not self._is_authorized(request, body):
+            return web.Response(status=403, text="SignatureDoesNotMatch")
+
+        bucket, _, key = request.path.lstrip("/").partition("/")
+        query = request.query
+        if not key:
+            if request.method == "PUT":
+                self.buckets.add(bucket)
+                return web.Response()
+            if request.method == "GET" and query.get("list-type") == "2":
+                return self._list(bucket, query.get("prefix", ""), query.get("continuation-token"))
+            return web.Response(status=405)
+        if bucket not in self.buckets:
+            return web.Response(status=404, text="NoSuchBucket")
+
+        object_key = f"{bucket}/{key}"
+        if request.method == "POST" and "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {}
+            return self._xml(f"<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+        if request.method == "PUT" and "uploadId" in query:
+            self.uploads[query["uploadId"]][int(query["partNumber"])] = body
+            return web.Response(headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+        if request.method == "POST" and "uploadId" in query:
+            parts = self.uploads.pop(query["uploadId"])
+            completion = ElementTree.fromstring(body)
+            content = b""
+            for part in completion.iter("Part"):
+                part_body = parts[int(part.findtext("PartNumber"))]
+                if part.findtext("ETag") != f'"{hashlib.md5(part_body).hexdigest()}"':
+                    return web.Response(status=400, text="InvalidPart")
+                content += part_body
+            self.objects[object_key] = (content, dt.datetime.now(dt.timezone.utc), None)
+            self.completed_uploads.append(len(parts))
+            return self._xml("<CompleteMultipartUploadResult></CompleteMultipartUploadResult>")
+        if request.method == "DELETE" and "uploadId" in query:
+            self.uploads.pop(query["uploadId"], None)
+            self.aborted_uploads += 1
+            return web.Response(status=204)
+
+        if request.method == "PUT":
+            self.objects[object_key] = (body, dt.datetime.now(dt.timezone.utc), request.headers.get("content-type"))
+            return web.Response()
+        if request.method == "DELETE":
+            self.objects.pop(object_key, None)
+            return web.Response(status=204)
+        if object_key not in self.objects:
+            return web.Response(status=404, text="NoSuchKey")
+        content, _, content_type = self.objects[object_key]
+        if request.method == "HEAD":
+            return web.Response(headers={"content-length": str(len(content))})
+        return web.Response(body=content, content_type=content_type or "application/octet-stream")
+
+    def _list(self, bucket: str, prefix: str, token: str | None) -> web.Response:
+        keys = sorted(
+            object_key.removeprefix(bucket + "/")
+            for object_key in self.objects
+            if object_key.startswith(f"{bucket}/{prefix}")
+        )
+        start = int(token) if token else 0
+        page = keys[start:start + self.page_size]
+        contents = "".join(
+            f"<Contents><Key>{key}</Key>"
+            f"<LastModified>{self.objects[f'{bucket}/{key}'][1].strftime('%Y-%m-%dT%H:%M:%S.000Z')}</LastModified>"
+            f"<Size>{len(self.objects[f'{bucket}/{key}'][0])}</Size></Contents>"
+            for key in page
+        )
+        truncated = start + self.page_size < len(keys)
+        next_token = f"<NextContinuationToken>{start + self.page_size}</NextContinuationToken>" if truncated else ""
+        return self._xml(
+            f"<ListBucketResult><IsTruncated>{str(truncated).lower()}</IsTruncated>{contents}{next_token}</ListBucketResult>"
+        )
+
+    @staticmethod
+    def _xml(content: str) -> web.Response:
+        root, rest = content[1:].split(">", 1)
+        return web.Response(
+            text=f'<?xml version="1.0" encoding="UTF-8"?><{root} xmlns="{xml_namespace}">{rest}',
+            content_type="application/xml",
+        )